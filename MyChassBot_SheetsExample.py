@@ -3,8 +3,9 @@
 import os
 import re
 import logging
-import requests
+import httpx
 import asyncio
+import collections
 from datetime import datetime
 
 from telegram import Update
@@ -13,6 +14,12 @@ from telegram.ext import ApplicationBuilder, MessageHandler, filters, ContextTyp
 import gspread
 from google.oauth2.service_account import Credentials
 
+try:
+    import h2  # HTTP/2 для httpx: pip install "httpx[http2]"
+    HAS_H2 = True
+except Exception:
+    HAS_H2 = False
+
 import time
 from gspread import Client
 from gspread.auth import AuthorizedSession
@@ -44,6 +51,17 @@ TOGETHER_API_KEY = os.environ.get("TOGETHER_API_KEY") or "4631235db33d35753063e6
 SERVICE_ACCOUNT_FILE = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS") or "D:\my cods\папка 5\causal-folder-463113-a8-b44594f9e475.json"
 SPREADSHEET_ID = os.environ.get("SPREADSHEET_ID") or "1gGJTFWY4N3koNOHo-ZsNYC-7_pJ9Bv5S-9jauVsU4KA"
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+
+# Together AI. Для проверки без реального API: python together_stub.py и
+# TOGETHER_API_URL=http://127.0.0.1:8089/v1/chat/completions
+TOGETHER_API_URL = os.environ.get("TOGETHER_API_URL") or "https://api.together.xyz/v1/chat/completions"
+TOGETHER_TIMEOUT = float(os.environ.get("TOGETHER_TIMEOUT") or 30)               # ждём ответ модели, сек
+TOGETHER_CONNECT_TIMEOUT = float(os.environ.get("TOGETHER_CONNECT_TIMEOUT") or 5)  # установка соединения, сек
+TOGETHER_MAX_CONCURRENCY = int(os.environ.get("TOGETHER_MAX_CONCURRENCY") or 8)  # одновременных запросов к LLM
+TOGETHER_MODEL = "meta-llama/Llama-3.3-70B-Instruct-Turbo-Free"
+TOGETHER_TEMPERATURE = 0.4
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL") or 3600)   # сколько секунд помним ответ
+LLM_CACHE_SIZE = int(os.environ.get("LLM_CACHE_SIZE") or 1000)   # сколько ответов держим в памяти
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
@@ -77,29 +95,111 @@ except Exception as e:
     logger.warning("Не удалось проверить/вставить заголовки: %s", e)
 
 # -------------------------
-# 5) Вспомогательные функции (блокировка вызывается асинхронно в executor)
+# 5) Вспомогательные функции (Sheets — синхронно в executor, LLM — асинхронно)
 # -------------------------
-def call_together_api(prompt: str) -> str:
-    """Вызывает Together AI (синхронно, поэтому мы запускаем в executor)."""
-    try:
-        response = requests.post(
-            "https://api.together.xyz/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {TOGETHER_API_KEY}",
-                "Content-Type": "application/json",
-            },
+together_client = None  # общий httpx.AsyncClient, создаётся при первом запросе в цикле бота
+together_slots = None   # Semaphore: не больше TOGETHER_MAX_CONCURRENCY запросов разом
+
+def get_together_client():
+    """Клиент с пулом соединений: TLS-рукопожатие один раз, дальше keep-alive (и HTTP/2, если есть h2)."""
+    global together_client, together_slots
+    if together_client is None:
+        together_client = httpx.AsyncClient(
+            http2=HAS_H2,
+            headers={"Authorization": f"Bearer {TOGETHER_API_KEY}"},
+            timeout=httpx.Timeout(TOGETHER_TIMEOUT, connect=TOGETHER_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=TOGETHER_MAX_CONCURRENCY,
+                                max_keepalive_connections=TOGETHER_MAX_CONCURRENCY,
+                                keepalive_expiry=60),
+        )
+        together_slots = asyncio.Semaphore(TOGETHER_MAX_CONCURRENCY)
+    return together_client
+
+async def close_together_client(app=None):
+    """Закрывает соединения с Together при остановке бота (post_shutdown)."""
+    global together_client
+    if together_client is not None:
+        await together_client.aclose()
+        together_client = None
+
+class LLMCache:
+    """Кэш ответов LLM в памяти: одинаковые (пересланные, повторные) сообщения не идут в Together.
+
+    Ключ — нормализованный промпт (регистр и лишние пробелы не важны), модель
+    и temperature. Ответ живёт ttl секунд, при переполнении вытесняется тот,
+    к которому дольше всего не обращались (LRU). Если такой же запрос уже
+    отправлен, второй не шлётся, а ждёт ответ первого; сам запрос идёт
+    отдельной задачей, так что отмена одного из ждущих не задевает остальных.
+    Ошибки не кэшируются: ожидающие получат ту же ошибку, а следующий запрос
+    пойдёт в API заново.
+    """
+
+    def __init__(self, ttl=LLM_CACHE_TTL, max_size=LLM_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = collections.OrderedDict()  # ключ -> (когда протухнет, ответ)
+        self._inflight = {}                      # ключ -> asyncio.Task запроса в полёте
+        self.hits = self.misses = self.coalesced = 0
+
+    @staticmethod
+    def make_key(prompt, model, temperature):
+        return " ".join(prompt.split()).lower(), model, temperature
+
+    async def get_or_call(self, key, call):
+        item = self._items.get(key)
+        if item is not None:
+            if item[0] > time.monotonic():
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            del self._items[key]
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = self._inflight[key] = asyncio.ensure_future(self._fetch(key, call))
+            # ошибку забираем сами, чтобы asyncio не ругался, если все ждавшие уже отменены
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        # запрос — отдельная задача: отмена одного ждущего не отменяет его для остальных
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key, call):
+        try:
+            reply = await call()
+        finally:
+            del self._inflight[key]
+        self._items[key] = (time.monotonic() + self.ttl, reply)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+        return reply
+
+
+llm_cache = LLMCache()
+
+async def request_together(prompt: str) -> str:
+    """Сам запрос к Together AI прямо из event loop, без потока на каждый запрос. Ошибки пробрасывает."""
+    client = get_together_client()
+    async with together_slots:
+        response = await client.post(
+            TOGETHER_API_URL,
             json={
-                "model": "meta-llama/Llama-3.3-70B-Instruct-Turbo-Free",
+                "model": TOGETHER_MODEL,
                 "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.4,
+                "temperature": TOGETHER_TEMPERATURE,
                 "max_tokens": 1500
             },
-            timeout=30
         )
-        response.raise_for_status()
-        data = response.json()
-        reply = data["choices"][0]["message"]["content"]
-        return reply.strip()
+    response.raise_for_status()
+    data = response.json()
+    reply = data["choices"][0]["message"]["content"]
+    return reply.strip()
+
+async def call_together_api(prompt: str) -> str:
+    """Ответ LLM через кэш; при ошибке — текст для пользователя вместо исключения."""
+    key = llm_cache.make_key(prompt, TOGETHER_MODEL, TOGETHER_TEMPERATURE)
+    try:
+        return await llm_cache.get_or_call(key, lambda: request_together(prompt))
     except Exception as e:
         logger.exception("Ошибка при вызове Together API")
         return "Ошибка при получении ответа от AI."
@@ -144,9 +244,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     loop = asyncio.get_running_loop()
 
-    # 1) Получаем ответ LLM в отдельном потоке (чтобы не блокировать event loop)
+    # 1) Получаем ответ LLM (асинхронный запрос, event loop не блокируется)
     try:
-        reply = await loop.run_in_executor(None, call_together_api, prompt)
+        reply = await call_together_api(prompt)
     except Exception as e:
         logger.exception("Ошибка при вызове LLM в executor")
         reply = "Извините, временная ошибка при обработке запроса."
@@ -174,7 +274,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # 7) Запуск бота
 # -------------------------
 if __name__ == "__main__":
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    app = ApplicationBuilder().token(BOT_TOKEN).post_shutdown(close_together_client).build()
     app.add_handler(CommandHandler("start", start))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     logger.info("Бот запущен...")
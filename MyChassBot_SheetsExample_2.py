@@ -3,8 +3,9 @@
 import os
 import re
 import logging
-import requests
+import httpx
 import asyncio
+import collections
 from datetime import datetime
 import time
 
@@ -14,6 +15,12 @@ from telegram.ext import ApplicationBuilder, MessageHandler, filters, ContextTyp
 import gspread
 from google.oauth2.service_account import Credentials
 
+try:
+    import h2  # HTTP/2 для httpx: pip install "httpx[http2]"
+    HAS_H2 = True
+except Exception:
+    HAS_H2 = False
+
 # -------------------------
 # 1) Настройки
 # -------------------------
@@ -23,6 +30,16 @@ SERVICE_ACCOUNT_FILE = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS") or r"D:\
 SPREADSHEET_ID = os.environ.get("SPREADSHEET_ID") or "1gGJTFWY4N3koNOHo-ZsNYC-7_pJ9Bv5S-9jauVsU4KA"
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
 
+# Together AI: адрес можно подменить на локальную заглушку (together_stub.py)
+TOGETHER_API_URL = os.environ.get("TOGETHER_API_URL") or "https://api.together.xyz/v1/chat/completions"
+TOGETHER_TIMEOUT = float(os.environ.get("TOGETHER_TIMEOUT") or 30)               # ответ модели, сек
+TOGETHER_CONNECT_TIMEOUT = float(os.environ.get("TOGETHER_CONNECT_TIMEOUT") or 5)
+TOGETHER_MAX_CONCURRENCY = int(os.environ.get("TOGETHER_MAX_CONCURRENCY") or 8)  # запросов к LLM одновременно
+TOGETHER_MODEL = "meta-llama/Llama-3.3-70B-Instruct-Turbo-Free"
+TOGETHER_TEMPERATURE = 0.4
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL") or 3600)   # сек
+LLM_CACHE_SIZE = int(os.environ.get("LLM_CACHE_SIZE") or 1000)   # ответов в памяти
+
 # -------------------------
 # 2) Логирование
 # -------------------------
@@ -62,26 +79,97 @@ except Exception as e:
 # -------------------------
 # 5) Функции
 # -------------------------
-def call_together_api(prompt: str) -> str:
-    """Вызов Together AI."""
-    try:
-        response = requests.post(
-            "https://api.together.xyz/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {TOGETHER_API_KEY}",
-                "Content-Type": "application/json",
-            },
+together_client = None
+together_slots = None
+
+def get_together_client():
+    """Один AsyncClient на весь бот: соединения с Together переиспользуются (keep-alive, HTTP/2)."""
+    global together_client, together_slots
+    if together_client is None:
+        together_client = httpx.AsyncClient(
+            http2=HAS_H2,
+            headers={"Authorization": f"Bearer {TOGETHER_API_KEY}"},
+            timeout=httpx.Timeout(TOGETHER_TIMEOUT, connect=TOGETHER_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=TOGETHER_MAX_CONCURRENCY,
+                                max_keepalive_connections=TOGETHER_MAX_CONCURRENCY,
+                                keepalive_expiry=60),
+        )
+        together_slots = asyncio.Semaphore(TOGETHER_MAX_CONCURRENCY)
+    return together_client
+
+async def close_together_client(app=None):
+    global together_client
+    if together_client is not None:
+        await together_client.aclose()
+        together_client = None
+
+class LLMCache:
+    """Кэш ответов LLM: TTL + LRU, одинаковые запросы в полёте объединяются в один, ошибки не кэшируются."""
+
+    def __init__(self, ttl=LLM_CACHE_TTL, max_size=LLM_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = collections.OrderedDict()  # ключ -> (когда протухнет, ответ)
+        self._inflight = {}                      # ключ -> asyncio.Task
+        self.hits = self.misses = self.coalesced = 0
+
+    @staticmethod
+    def make_key(prompt, model, temperature):
+        return " ".join(prompt.split()).lower(), model, temperature
+
+    async def get_or_call(self, key, call):
+        item = self._items.get(key)
+        if item is not None:
+            if item[0] > time.monotonic():
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            del self._items[key]
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = self._inflight[key] = asyncio.ensure_future(self._fetch(key, call))
+            # ошибку забираем сами, чтобы asyncio не ругался, если все ждавшие уже отменены
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        # запрос — отдельная задача: отмена одного ждущего не отменяет его для остальных
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key, call):
+        try:
+            reply = await call()
+        finally:
+            del self._inflight[key]
+        self._items[key] = (time.monotonic() + self.ttl, reply)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+        return reply
+
+llm_cache = LLMCache()
+
+async def request_together(prompt: str) -> str:
+    """Запрос к Together AI (ошибки пробрасывает)."""
+    client = get_together_client()
+    async with together_slots:
+        response = await client.post(
+            TOGETHER_API_URL,
             json={
-                "model": "meta-llama/Llama-3.3-70B-Instruct-Turbo-Free",
+                "model": TOGETHER_MODEL,
                 "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.4,
+                "temperature": TOGETHER_TEMPERATURE,
                 "max_tokens": 1500
             },
-            timeout=30
         )
-        response.raise_for_status()
-        data = response.json()
-        return data["choices"][0]["message"]["content"].strip()
+    response.raise_for_status()
+    data = response.json()
+    return data["choices"][0]["message"]["content"].strip()
+
+async def call_together_api(prompt: str) -> str:
+    """Вызов Together AI через кэш."""
+    key = llm_cache.make_key(prompt, TOGETHER_MODEL, TOGETHER_TEMPERATURE)
+    try:
+        return await llm_cache.get_or_call(key, lambda: request_together(prompt))
     except Exception as e:
         logger.exception("Ошибка при вызове Together API")
         return "Ошибка при получении ответа от AI."
@@ -131,7 +219,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     loop = asyncio.get_running_loop()
 
     try:
-        reply = await loop.run_in_executor(None, call_together_api, prompt)
+        reply = await call_together_api(prompt)
     except Exception:
         reply = "Извините, временная ошибка при обработке запроса."
 
@@ -154,7 +242,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # 7) Запуск бота
 # -------------------------
 if __name__ == "__main__":
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    app = ApplicationBuilder().token(BOT_TOKEN).post_shutdown(close_together_client).build()
     app.add_handler(CommandHandler("start", start))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     logger.info("Бот запущен...")
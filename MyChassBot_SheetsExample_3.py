@@ -3,9 +3,13 @@
 
 import os
 import re
-import time
+import random
 import logging
 import asyncio
+import functools
+import threading
+import collections
+import concurrent.futures
 from datetime import datetime, timezone
 
 from telegram import Update
@@ -27,6 +31,13 @@ SPREADSHEET_ID = os.environ.get("SPREADSHEET_ID") or "1-Zwh6d30h7rIb9HNXycDnZwFe
 
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
 
+# Запись в таблицу пачками (см. SheetWriter)
+SHEETS_BATCH_SIZE = 50        # строк в одном append_rows
+SHEETS_FLUSH_INTERVAL = 1.0   # сек: сколько ждать, пока пачка наберётся
+SHEETS_MAX_ATTEMPTS = 6       # попыток на пачку при временных ошибках
+SHEETS_BACKOFF_BASE = 1.0     # первая пауза между попытками, сек
+SHEETS_BACKOFF_MAX = 30.0     # потолок паузы, сек
+
 # -------------------------
 # Логирование
 # -------------------------
@@ -34,18 +45,6 @@ logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s
                     level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# -------------------------
-# Подключение к Google Sheets
-# -------------------------
-try:
-    creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-    gc = gspread.authorize(creds)
-    sheet = gc.open_by_key(SPREADSHEET_ID).sheet1
-    logger.info("Успешно подключились к Google Sheets.")
-except Exception as e:
-    logger.exception("Ошибка при подключении к Google Sheets. Проверь SERVICE_ACCOUNT_FILE и SPREADSHEET_ID.")
-    raise
-
 # -------------------------
 # Заголовки: порядок столбцов в таблице (именно такой вывел пользователь)
 # -------------------------
@@ -58,15 +57,42 @@ HEADERS = [
     "Описание проблемы",
     "Пробег / Моточасы"
 ]
-try:
-    first_row = sheet.row_values(1)
-    # если таблица новая или первая ячейка не совпадает — вставим заголовки
-    if not first_row or first_row[:len(HEADERS)] != HEADERS:
-        # Если там уже есть данные, insert_row сдвинет их вниз
-        sheet.insert_row(HEADERS, index=1)
-        logger.info("Добавлены заголовки в таблицу.")
-except Exception as e:
-    logger.warning("Не удалось проверить/вставить заголовки: %s", e)
+
+# -------------------------
+# Подключение к Google Sheets (лениво, при первом обращении)
+# -------------------------
+sheet = None
+sheet_lock = threading.Lock()
+
+def get_sheet():
+    """
+    Подключается к таблице при первом вызове, проверяет заголовки и кэширует лист.
+    Пока подключение не готово, остальные вызовы ждут на блокировке, а не падают.
+    """
+    global sheet
+    with sheet_lock:
+        if sheet is None:
+            creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+            gc = gspread.authorize(creds)
+            ws = gc.open_by_key(SPREADSHEET_ID).sheet1
+            logger.info("Успешно подключились к Google Sheets.")
+            try:
+                first_row = ws.row_values(1)
+                # если таблица новая или первая ячейка не совпадает — вставим заголовки
+                if not first_row or first_row[:len(HEADERS)] != HEADERS:
+                    # Если там уже есть данные, insert_row сдвинет их вниз
+                    ws.insert_row(HEADERS, index=1)
+                    logger.info("Добавлены заголовки в таблицу.")
+            except Exception as e:
+                logger.warning("Не удалось проверить/вставить заголовки: %s", e)
+            sheet = ws
+        return sheet
+
+def warm_up_sheets():
+    try:
+        get_sheet()
+    except Exception:
+        logger.exception("Ошибка при подключении к Google Sheets. Проверь SERVICE_ACCOUNT_FILE и SPREADSHEET_ID.")
 
 # -------------------------
 # Парсер: извлечение нужных полей из сообщения
@@ -162,22 +188,116 @@ def parse_message(text: str):
     }
 
 # -------------------------
-# Запись в Google Sheets с retry
+# Запись в Google Sheets пачками, с повторами
 # -------------------------
-def append_row_with_retry(row, retries=3, delay=2):
-    """
-    Попытаться записать строку в Google Sheet. Возвращает True при успехе.
+def is_retryable_error(e):
+    """429, 408 и 5xx, а также обрыв связи и таймаут — временные; остальное — нет."""
+    response = getattr(e, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is None:
+        return isinstance(e, (ConnectionError, TimeoutError,
+                              requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+    return status in (408, 429) or status >= 500
+
+def backoff_delay(attempt, base=SHEETS_BACKOFF_BASE, cap=SHEETS_BACKOFF_MAX):
+    """Экспоненциальная пауза с полным джиттером: случайно от 0 до base * 2^(attempt-1)."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class SheetWriter:
+    """Фоновая запись в таблицу пачками.
+
+    submit() кладёт строку в очередь и сразу возвращает Future; фоновый поток
+    отправляет накопившиеся строки одним append_rows — когда набралось
+    batch_size строк или прошло flush_interval секунд. Future завершится True,
+    когда строка попала в таблицу, и False, если записать не удалось.
+    Временные ошибки повторяются с экспоненциальной паузой (asyncio.sleep
+    в своём цикле потока, не time.sleep), не больше max_attempts раз. Если
+    Google отверг пачку целиком (400), она делится пополам, чтобы одна плохая
+    строка не утянула чужие.
     """
-    for attempt in range(1, retries + 1):
-        try:
-            sheet.append_row(row, value_input_option='USER_ENTERED')
-            logger.info("Строка успешно записана (попытка %d).", attempt)
-            return True
-        except Exception as e:
-            logger.error("Ошибка записи в Google Sheets (попытка %d): %s", attempt, e)
-            if attempt < retries:
-                time.sleep(delay)
-    return False
+
+    def __init__(self, batch_size=SHEETS_BATCH_SIZE, flush_interval=SHEETS_FLUSH_INTERVAL,
+                 max_attempts=SHEETS_MAX_ATTEMPTS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self._rows = collections.deque()  # (строка, Future)
+        self._loop = None
+        self._wakeup = None
+        self._ready = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._ready.clear()
+                self._thread = threading.Thread(target=self._run, name="SheetWriterThread", daemon=True)
+                self._thread.start()
+        self._ready.wait()
+
+    def submit(self, row):
+        fut = concurrent.futures.Future()
+        with self._lock:
+            self._rows.append((row, fut))
+        self.start()
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+        return fut
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._wakeup = asyncio.Event()
+        self._ready.set()
+        self._loop.run_until_complete(self._main())
+
+    async def _main(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            if not self._rows:
+                await self._wakeup.wait()
+            # даём пачке набраться
+            deadline = loop.time() + self.flush_interval
+            while len(self._rows) < self.batch_size and loop.time() < deadline:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+            with self._lock:
+                batch = [self._rows.popleft() for _ in range(min(self.batch_size, len(self._rows)))]
+            await self._send(batch)
+
+    async def _send(self, batch):
+        loop = asyncio.get_running_loop()
+        rows = [row for row, _ in batch]
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                ws = await loop.run_in_executor(None, get_sheet)
+                await loop.run_in_executor(
+                    None, functools.partial(ws.append_rows, rows, value_input_option='USER_ENTERED'))
+                logger.info("Записано строк: %d (попытка %d).", len(rows), attempt)
+                ok = True
+                break
+            except Exception as e:
+                logger.error("Ошибка записи в Google Sheets (попытка %d): %s", attempt, e)
+                status = getattr(getattr(e, "response", None), "status_code", None)
+                if status == 400 and len(batch) > 1:
+                    half = len(batch) // 2
+                    await self._send(batch[:half])
+                    await self._send(batch[half:])
+                    return
+                if not is_retryable_error(e) or attempt == self.max_attempts:
+                    ok = False
+                    break
+                await asyncio.sleep(backoff_delay(attempt))
+        for _, fut in batch:
+            fut.set_result(ok)
+
+
+sheet_writer = SheetWriter()
 
 # -------------------------
 # Telegram handlers
@@ -208,8 +328,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parsed["mileage_hours"]
     ]
 
-    loop = asyncio.get_running_loop()
-    success = await loop.run_in_executor(None, append_row_with_retry, row)
+    success = await asyncio.wrap_future(sheet_writer.submit(row))
 
     # Ответ пользователю: краткое подтверждение + распарсенные ключевые поля
     if success:
@@ -232,6 +351,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # Запуск бота
 # -------------------------
 if __name__ == "__main__":
+    # подключаемся к таблице в фоне, чтобы polling стартовал сразу
+    threading.Thread(target=warm_up_sheets, name="SheetsConnectThread", daemon=True).start()
     app = ApplicationBuilder().token(BOT_TOKEN).build()
     app.add_handler(CommandHandler("start", start))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
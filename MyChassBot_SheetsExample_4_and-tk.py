@@ -1,12 +1,15 @@
 
 import os
 import re
-import time
 import queue
+import random
 import asyncio
 import atexit
 import json
+import functools
 import threading
+import collections
+import concurrent.futures
 import logging
 import tkinter as tk
 from datetime import datetime, timezone
@@ -17,6 +20,7 @@ from telegram.ext import ApplicationBuilder, MessageHandler, filters, ContextTyp
 
 # ---------- Google Sheets ----------
 import gspread
+import requests
 from google.oauth2.service_account import Credentials
 
 # ---------- Tk / UI ----------
@@ -37,6 +41,13 @@ SERVICE_ACCOUNT_FILE = ""
 SPREADSHEET_ID = ""
 SEND_TO_CHAT_ID = None  # можно задать ID чата для дублирования
 
+# Запись в таблицу пачками (см. SheetWriter)
+SHEETS_BATCH_SIZE = 50        # строк в одном append_rows
+SHEETS_FLUSH_INTERVAL = 1.0   # сек: сколько ждать, пока пачка наберётся
+SHEETS_MAX_ATTEMPTS = 6       # попыток на пачку при временных ошибках
+SHEETS_BACKOFF_BASE = 1.0     # первая пауза между попытками, сек
+SHEETS_BACKOFF_MAX = 30.0     # потолок паузы, сек
+
 SCOPES = [
     'https://www.googleapis.com/auth/spreadsheets',
     'https://www.googleapis.com/auth/drive'
@@ -95,17 +106,150 @@ def connect_sheets():
     ws = sh.sheet1
     return ws
 
-def append_row_with_retry(row, retries=3, delay=2):
-    for attempt in range(1, retries + 1):
-        try:
-            sheet.append_row(row, value_input_option='USER_ENTERED')
-            logger.info("Строка успешно записана (попытка %d).", attempt)
-            return True
-        except Exception as e:
-            logger.error("Ошибка записи в Google Sheets (попытка %d): %s", attempt, e)
-            if attempt < retries:
-                time.sleep(delay)
-    return False
+sheet = None
+sheet_lock = threading.Lock()
+
+def get_sheet():
+    """Подключается к таблице при первом обращении и кэширует лист.
+
+    Пока идёт подключение, остальные вызовы ждут на блокировке — сообщения
+    встают в очередь, а не получают ошибку.
+    """
+    global sheet
+    with sheet_lock:
+        if sheet is None:
+            ws = connect_sheets()
+            try:
+                first_row = ws.row_values(1)
+                if not first_row or first_row[:len(HEADERS)] != HEADERS:
+                    ws.insert_row(HEADERS, index=1)
+            except Exception as e:
+                logger.warning("Не удалось проверить заголовки: %s", e)
+            sheet = ws
+            logger.info("Подключились к Google Sheets.")
+        return sheet
+
+def warm_up_sheets():
+    try:
+        get_sheet()
+    except Exception as e:
+        logger.error("Не удалось подключиться к Google Sheets: %s", e)
+
+def reconnect_sheets():
+    """Сбросить подключение (после смены настроек) и подключиться заново в фоне."""
+    global sheet
+    with sheet_lock:
+        sheet = None
+    warm_up_sheets()
+
+def is_retryable_error(e):
+    """429, 408 и 5xx, а также обрыв связи и таймаут — временные; остальное — нет."""
+    response = getattr(e, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is None:
+        return isinstance(e, (ConnectionError, TimeoutError,
+                              requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+    return status in (408, 429) or status >= 500
+
+def backoff_delay(attempt, base=SHEETS_BACKOFF_BASE, cap=SHEETS_BACKOFF_MAX):
+    """Экспоненциальная пауза с полным джиттером: случайно от 0 до base * 2^(attempt-1)."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class SheetWriter:
+    """Фоновая запись в таблицу пачками.
+
+    submit() кладёт строку в очередь и сразу возвращает Future; фоновый поток
+    отправляет накопившиеся строки одним append_rows — когда набралось
+    batch_size строк или прошло flush_interval секунд. Future завершится True,
+    когда строка попала в таблицу, и False, если записать не удалось.
+    Временные ошибки повторяются с экспоненциальной паузой (asyncio.sleep
+    в своём цикле потока, не time.sleep), не больше max_attempts раз. Если
+    Google отверг пачку целиком (400), она делится пополам, чтобы одна плохая
+    строка не утянула чужие.
+    """
+
+    def __init__(self, batch_size=SHEETS_BATCH_SIZE, flush_interval=SHEETS_FLUSH_INTERVAL,
+                 max_attempts=SHEETS_MAX_ATTEMPTS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self._rows = collections.deque()  # (строка, Future)
+        self._loop = None
+        self._wakeup = None
+        self._ready = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._ready.clear()
+                self._thread = threading.Thread(target=self._run, name="SheetWriterThread", daemon=True)
+                self._thread.start()
+        self._ready.wait()
+
+    def submit(self, row):
+        fut = concurrent.futures.Future()
+        with self._lock:
+            self._rows.append((row, fut))
+        self.start()
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+        return fut
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._wakeup = asyncio.Event()
+        self._ready.set()
+        self._loop.run_until_complete(self._main())
+
+    async def _main(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            if not self._rows:
+                await self._wakeup.wait()
+            # даём пачке набраться
+            deadline = loop.time() + self.flush_interval
+            while len(self._rows) < self.batch_size and loop.time() < deadline:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+            with self._lock:
+                batch = [self._rows.popleft() for _ in range(min(self.batch_size, len(self._rows)))]
+            await self._send(batch)
+
+    async def _send(self, batch):
+        loop = asyncio.get_running_loop()
+        rows = [row for row, _ in batch]
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                ws = await loop.run_in_executor(None, get_sheet)
+                await loop.run_in_executor(
+                    None, functools.partial(ws.append_rows, rows, value_input_option='USER_ENTERED'))
+                logger.info("Записано строк: %d (попытка %d).", len(rows), attempt)
+                ok = True
+                break
+            except Exception as e:
+                logger.error("Ошибка записи в Google Sheets (попытка %d): %s", attempt, e)
+                status = getattr(getattr(e, "response", None), "status_code", None)
+                if status == 400 and len(batch) > 1:
+                    half = len(batch) // 2
+                    await self._send(batch[:half])
+                    await self._send(batch[half:])
+                    return
+                if not is_retryable_error(e) or attempt == self.max_attempts:
+                    ok = False
+                    break
+                await asyncio.sleep(backoff_delay(attempt))
+        for _, fut in batch:
+            fut.set_result(ok)
+
+
+sheet_writer = SheetWriter()
 
 
 # ===========================
@@ -210,8 +354,7 @@ async def tg_handle(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     parsed = parse_message(text)
     row = make_row(parsed)
-    loop = asyncio.get_running_loop()
-    ok = await loop.run_in_executor(None, append_row_with_retry, row)
+    ok = await asyncio.wrap_future(sheet_writer.submit(row))
     if ok:
         await update.message.reply_text("✅ Данные записаны.")
     else:
@@ -332,11 +475,16 @@ class AppUI:
         parsed = parse_message(text)
         self._fill_preview(parsed)
         row = make_row(parsed)
-        ok = append_row_with_retry(row)
-        if ok:
-            self._append_log("✅ Запись добавлена в Google Sheets.\n")
+        # окно не ждёт таблицу: результат придёт из потока SheetWriter
+        self._append_log("📤 Отправляется в таблицу...\n")
+        sheet_writer.submit(row).add_done_callback(self._on_send_done)
+
+    def _on_send_done(self, fut):
+        # вызывается из потока SheetWriter, поэтому пишем через log_queue
+        if fut.result():
+            log_queue.put("✅ Запись добавлена в Google Sheets.")
         else:
-            self._append_log("⚠ Не удалось записать.\n")
+            log_queue.put("⚠ Не удалось записать.")
 
     def open_settings_window(self):
         win = tk.Toplevel(self.root)
@@ -359,7 +507,7 @@ class AppUI:
         ent_sheet.pack(fill="x")
 
         def save_and_apply():
-            global BOT_TOKEN, SERVICE_ACCOUNT_FILE, SPREADSHEET_ID, sheet
+            global BOT_TOKEN, SERVICE_ACCOUNT_FILE, SPREADSHEET_ID
             BOT_TOKEN = ent_token.get().strip()
             SERVICE_ACCOUNT_FILE = ent_cred.get().strip()
             link = ent_sheet.get().strip()
@@ -375,11 +523,9 @@ class AppUI:
                 "GOOGLE_APPLICATION_CREDENTIALS": SERVICE_ACCOUNT_FILE,
                 "SPREADSHEET_ID": SPREADSHEET_ID
             })
-            try:
-                sheet = connect_sheets()
-                self._append_log("✅ Настройки сохранены и подключение обновлено.\n")
-            except Exception as e:
-                self._append_log(f"⚠ Ошибка подключения: {e}\n")
+            # подключение — в фоне: окно не замирает, результат придёт в лог
+            threading.Thread(target=reconnect_sheets, name="SheetsConnectThread", daemon=True).start()
+            self._append_log("✅ Настройки сохранены, переподключаемся к таблице...\n")
             win.destroy()
 
         tk.Button(win, text="Сохранить", command=save_and_apply).pack(pady=10)
@@ -395,15 +541,9 @@ BOT_TOKEN = cfg.get("BOT_TOKEN", BOT_TOKEN)
 SERVICE_ACCOUNT_FILE = cfg.get("GOOGLE_APPLICATION_CREDENTIALS", SERVICE_ACCOUNT_FILE)
 SPREADSHEET_ID = cfg.get("SPREADSHEET_ID", SPREADSHEET_ID)
 
-sheet = connect_sheets()
-try:
-    first_row = sheet.row_values(1)
-    if not first_row or first_row[:len(HEADERS)] != HEADERS:
-        sheet.insert_row(HEADERS, index=1)
-except Exception as e:
-    logger.warning("Не удалось проверить заголовки: %s", e)
-
 def start_threads():
+    # подключение к таблице идёт в фоне и не задерживает запуск бота и окна
+    threading.Thread(target=warm_up_sheets, name="SheetsConnectThread", daemon=True).start()
     t = threading.Thread(target=run_telegram_bot, name="TelegramBotThread", daemon=True)
     t.start()
 
@@ -5,8 +5,22 @@ import queue
 import asyncio
 import atexit
 import json
+import uuid
+import hashlib
+import random
+import sqlite3
+import functools
+import contextlib
+import itertools
+import collections
+import multiprocessing
+import importlib.machinery
 import threading
+import http.server
+import socket
 import logging
+import subprocess
+import concurrent.futures
 import tkinter as tk
 from pydub import AudioSegment
 from datetime import datetime, timezone
@@ -14,16 +28,25 @@ from datetime import datetime, timezone
 
 # ---------- Telegram ----------
 from telegram import Update
-from telegram.ext import ApplicationBuilder, MessageHandler, filters, ContextTypes, CommandHandler
+from telegram.ext import ApplicationBuilder, MessageHandler, filters, ContextTypes, CommandHandler, BaseUpdateProcessor, TypeHandler
 
 # ---------- Google Sheets ----------
 import gspread
+import requests
+import google.auth.exceptions
 from google.oauth2.service_account import Credentials
 
 # ---------- Speech / Voice ----------
 import speech_recognition as sr
 from pydub import AudioSegment
-import tempfile
+from pydub.silence import detect_nonsilent
+
+# Локальное распознавание (необязательно): pip install vosk + модель с alphacephei.com/vosk/models
+try:
+    import vosk
+    HAS_VOSK = True
+except Exception:
+    HAS_VOSK = False
 
 # Укажи путь к ffmpeg.exe
 AudioSegment.converter = r"C:\\Users\\user\\Downloads\\ffmpeg-2025-09-10-git-c1dc2e2b7c-essentials_build\\ffmpeg-2025-09-10-git-c1dc2e2b7c-essentials_build\\bin\\ffmpeg.exe"
@@ -51,6 +74,62 @@ SCOPES = [
     'https://www.googleapis.com/auth/drive'
 ]
 
+SHEETS_BATCH_SIZE = 50        # максимум строк в одном append_rows
+SHEETS_FLUSH_INTERVAL = 1.0   # сколько секунд ждём, пока наберётся пачка
+SHEETS_BACKOFF_BASE = 1.0     # первая пауза между попытками, сек
+SHEETS_BACKOFF_MAX = 30.0     # потолок паузы, сек
+SHEETS_RATE_PER_MIN = 60      # запросов к Sheets в минуту на весь процесс (квота Google — 60 на пользователя)
+SHEETS_RATE_BURST = 10        # сколько запросов можно сделать подряд без ожидания
+JOURNAL_FILE = "journal.db"   # локальный журнал строк (пишем сюда до отправки в таблицу)
+JOURNAL_KEEP_DAYS = 30        # сколько дней хранить уже отправленные строки
+PARSE_CHUNK_SIZE = 200        # сообщений на одну задачу пула в parse_messages
+DEDUP_WINDOW_MIN = 30         # одинаковый отчёт по шасси в этом окне считается повтором
+
+VOICE_SAMPLE_RATE = 16000     # распознаванию хватает 16 кГц — втрое меньше данных, чем исходные 48 кГц
+VOICE_CHANNELS = 1
+VOICE_SAMPLE_WIDTH = 2        # 16 бит
+VOICE_WORKERS = 2             # процессов для декодирования и распознавания
+VOICE_QUEUE_MAX = 20          # сколько голосовых максимум ждут в очереди
+# тишину в начале и в конце срезаем (areverse — чтобы тем же фильтром обрезать хвост),
+# громкость выравниваем: тихие записи из кабины распознаются заметно лучше
+VOICE_AUDIO_FILTER = ("silenceremove=start_periods=1:start_threshold=-50dB:start_silence=0.2,"
+                      "areverse,"
+                      "silenceremove=start_periods=1:start_threshold=-50dB:start_silence=0.2,"
+                      "areverse,"
+                      "loudnorm=I=-20:TP=-2")
+VOICE_CHUNK_MAX_SEC = 15      # длинные голосовые режем по паузам на куски не длиннее этого
+VOICE_SILENCE_MIN_MS = 400    # пауза короче — не пауза
+VOICE_SILENCE_DB = 16         # тишина — на столько дБ тише среднего уровня записи
+VOICE_CHUNK_PAD_MS = 200      # запас вокруг куска, чтобы не срезать начало и конец слов
+ASR_BACKENDS = ["google"]     # движки распознавания по порядку: если первый не справился — берём следующий
+ASR_LANGUAGE = "ru-RU"
+VOSK_MODEL_PATH = "models/vosk-model-small-ru-0.22"
+VOICE_CACHE_FILE = "voice_cache.db"   # кэш распознанных голосовых
+VOICE_CACHE_MAX_ENTRIES = 5000
+VOICE_CACHE_MAX_AGE_DAYS = 30
+PERF_KEEP = 1000              # сколько последних замеров на стадию держать для перцентилей
+ADMIN_IDS = []                # Telegram user id, которым доступна /perf
+MAX_CONCURRENT_UPDATES = 32   # апдейтов из разных чатов обрабатываем одновременно
+WORKERS = 1                   # >1 — апдейты разбираются в стольких процессах, по chat_id
+# Метрики в формате Prometheus на http://listen:port/metrics (воркеры — на port+1, port+2, ...)
+METRICS = {"enabled": False, "listen": "127.0.0.1", "port": 9108}
+SAVE_CONFIRM_TIMEOUT = 30     # сек; дольше — предупреждаем, что запись задерживается
+
+# Webhook вместо long polling (нужен pip install "python-telegram-bot[webhooks]").
+# Бот слушает обычный HTTP на listen:port, TLS снимает reverse proxy (nginx, caddy),
+# который проксирует https://<url>/<path> сюда. Если webhook не поднялся — работаем через polling,
+# а если копий несколько (delete_on_stop: False) — повторяем попытку: polling снял бы общий webhook.
+WEBHOOK = {
+    "enabled": False,
+    "url": "",               # публичный https-адрес без path, например https://bot.example.com
+    "listen": "127.0.0.1",
+    "port": 8443,
+    "path": "telegram",
+    "secret_token": "",      # пусто — выводим из BOT_TOKEN, одинаковый у всех копий бота
+    "delete_on_stop": True,  # за одним адресом несколько копий бота — ставьте False
+    "retry_sec": 30,         # пауза между попытками поднять webhook, когда polling нельзя
+}
+
 HEADERS = [
     "Организация",
     "Дата",
@@ -58,7 +137,8 @@ HEADERS = [
     "Модель самосвала",
     "Что вышло из строя",
     "Описание проблемы",
-    "Пробег / Моточасы"
+    "Пробег / Моточасы",
+    "Ключ"  # идемпотентный ключ записи из журнала
 ]
 # ===========================
 # ЛОГИРОВАНИЕ
@@ -81,6 +161,144 @@ queue_handler = QueueHandler()
 queue_handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
 logger.addHandler(queue_handler)
 
+# ===========================
+# ЗАМЕРЫ ВРЕМЕНИ
+# ===========================
+# по JSON-строке на каждый замер — в консоль, а не в окно (там их было бы слишком много)
+perf_logger = logging.getLogger("perf")
+
+
+class Metrics:
+    """Счётчики, гистограммы и датчики для /metrics в текстовом формате Prometheus."""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()  # (имя, метки) -> значение
+        self._histograms = {}                   # (имя, метки) -> [счётчики по корзинам, сумма, количество]
+        self._gauges = {}                       # имя -> функция, которую зовём при каждом запросе
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[name, tuple(sorted(labels.items()))] += value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [[0] * len(self.BUCKETS), 0.0, 0]
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    hist[0][i] += 1
+            hist[1] += seconds
+            hist[2] += 1
+
+    def gauge(self, name, func):
+        self._gauges[name] = func
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+        return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((k, [list(v[0]), v[1], v[2]]) for k, v in self._histograms.items())
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), (buckets, total, count) in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            for bound, n in zip(self.BUCKETS, buckets):
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {n}")
+            lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{self._labels(labels)} {total}")
+            lines.append(f"{name}_count{self._labels(labels)} {count}")
+        for name, func in sorted(self._gauges.items()):
+            try:
+                value = func()
+            except Exception:
+                continue
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+
+class PerfStats:
+    """Время стадий обработки: скачивание, распознавание, парсинг, запись в таблицу.
+
+    По каждой стадии держим последние keep замеров и общий счётчик — этого
+    хватает на p50/p95/p99, и память не растёт. Пишут сюда поток бота,
+    SheetWriter и Tk, поэтому всё под блокировкой.
+    """
+
+    def __init__(self, keep=PERF_KEEP):
+        self.keep = keep
+        self._samples = {}
+        self._counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds, **fields):
+        with self._lock:
+            if stage not in self._samples:
+                self._samples[stage] = collections.deque(maxlen=self.keep)
+            self._samples[stage].append(seconds)
+            self._counts[stage] += 1
+        metrics.observe("chassbot_stage_seconds", seconds, stage=stage)
+        perf_logger.info(json.dumps({"stage": stage, "ms": round(seconds * 1000, 1), **fields},
+                                    ensure_ascii=False))
+
+    @contextlib.contextmanager
+    def span(self, stage, **fields):
+        """with perf_stats.span("parse", chat=...): ... — замер блока (и в async-коде тоже)."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            fields["error"] = type(e).__name__
+            raise
+        finally:
+            self.add(stage, time.perf_counter() - t0, **fields)
+
+    def summary(self):
+        """{стадия: {count, p50, p95, p99}}, время в секундах."""
+        with self._lock:
+            snapshot = [(stage, sorted(samples), self._counts[stage]) for stage, samples in self._samples.items()]
+        return {stage: {"count": count, "p50": percentile(values, 50),
+                        "p95": percentile(values, 95), "p99": percentile(values, 99)}
+                for stage, values, count in snapshot}
+
+
+perf_stats = PerfStats()
+
+
+def timed_call(func, *args):
+    """Вызов в процессе пула, который возвращает и результат, и сколько он занял."""
+    t0 = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - t0
+
 # ===========================
 # CONFIG JSON
 # ===========================
@@ -97,65 +315,557 @@ def save_config(cfg):
 # ===========================
 # GOOGLE SHEETS
 # ===========================
+sheet = None  # подключаемся лениво, в потоке SheetWriter
+
+
+class RateLimiter:
+    """Token bucket для квоты Google Sheets, общий для всех потоков процесса.
+
+    Токены копятся со скоростью per_minute в минуту, но не больше burst.
+    Каждый запрос забирает токен; если их нет, токен «берётся в долг»
+    (счётчик уходит в минус), а вызывающий ждёт, пока долг погасится.
+    Так очередь обслуживается честно и без гонок между потоками.
+    """
+
+    def __init__(self, per_minute=SHEETS_RATE_PER_MIN, burst=SHEETS_RATE_BURST):
+        self._lock = threading.Lock()
+        self.configure(per_minute, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self.acquired = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+
+    def configure(self, per_minute, burst):
+        with self._lock:
+            self.per_minute = per_minute
+            self.burst = burst
+
+    def _reserve(self, n):
+        with self._lock:
+            now = time.monotonic()
+            rate = self.per_minute / 60.0
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * rate)
+            self._updated = now
+            self._tokens -= n
+            delay = -self._tokens / rate if self._tokens < 0 else 0.0
+            self.acquired += n
+            if delay:
+                self.waited += 1
+                self.wait_seconds += delay
+            return delay
+
+    def acquire(self, n=1):
+        """Блокирующее ожидание — для синхронного кода (Tk, импорт, подключение)."""
+        delay = self._reserve(n)
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self, n=1):
+        """То же для asyncio: ждём через asyncio.sleep, поток не занимаем."""
+        delay = self._reserve(n)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        with self._lock:
+            rate = self.per_minute / 60.0
+            tokens = min(self.burst, self._tokens + (time.monotonic() - self._updated) * rate)
+            return {
+                "tokens": round(tokens, 2),
+                "per_minute": self.per_minute,
+                "burst": self.burst,
+                "acquired": self.acquired,
+                "waited": self.waited,
+                "wait_seconds": round(self.wait_seconds, 2),
+            }
+
+
+sheets_limiter = RateLimiter()
+
+def sheets_call(func, *args, **kwargs):
+    """Любой запрос к Google Sheets из синхронного кода — только через лимитер."""
+    sheets_limiter.acquire()
+    return func(*args, **kwargs)
+
+async def sheets_call_async(func, *args, **kwargs):
+    """Запрос к Google Sheets из asyncio: ждём токен асинхронно, сам запрос — в executor."""
+    await sheets_limiter.acquire_async()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
 def connect_sheets():
     creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
     gc = gspread.authorize(creds)
-    sh = gc.open_by_key(SPREADSHEET_ID)
-    ws = sh.sheet1
+    sh = sheets_call(gc.open_by_key, SPREADSHEET_ID)
+    ws = sheets_call(sh.get_worksheet, 0)  # sh.sheet1 — тоже запрос к API, мимо лимитера
     return ws
 
-def append_row_with_retry(row, retries=3, delay=2):
-    for attempt in range(1, retries + 1):
+# сетевые ошибки без HTTP-ответа: обрыв, таймаут, DNS, сбой обновления токена
+NETWORK_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    socket.gaierror,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    google.auth.exceptions.TransportError,
+)
+
+def error_status(e):
+    """HTTP-статус ответа Google, если ошибка пришла с ответом; иначе None."""
+    return getattr(getattr(e, "response", None), "status_code", None)
+
+def is_retryable_error(e):
+    """429, 408 и 5xx, а также сетевые ошибки — временные; остальное (400, 403, 404, нет ключа, ошибки кода) — нет."""
+    status = error_status(e)
+    if status is None:
+        return isinstance(e, NETWORK_ERRORS)
+    return status in (408, 429) or status >= 500
+
+def backoff_delay(attempt, base=SHEETS_BACKOFF_BASE, cap=SHEETS_BACKOFF_MAX):
+    """Экспоненциальная пауза с полным джиттером: случайно от 0 до base * 2^(attempt-1)."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def ensure_headers(ws):
+    first_row = sheets_call(ws.row_values, 1)
+    if first_row and first_row[:len(HEADERS)] != HEADERS and first_row[:len(HEADERS) - 1] == HEADERS[:-1]:
+        # таблица со старыми заголовками — дописываем только колонку ключа
+        sheets_call(ws.update_cell, 1, len(HEADERS), HEADERS[-1])
+    elif not first_row or first_row[:len(HEADERS)] != HEADERS:
+        sheets_call(ws.insert_row, HEADERS, index=1)
+
+
+class RowJournal:
+    """Локальный журнал строк (SQLite в режиме WAL).
+
+    Каждая строка сначала попадает сюда со статусом pending, и только потом
+    уходит в таблицу. Статусы: pending → sending → sent (или failed при
+    постоянной ошибке). Ключ уникален, поэтому повторная запись того же
+    сообщения (например, Telegram прислал апдейт ещё раз) не создаёт дубль.
+    """
+
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rows ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " key TEXT NOT NULL UNIQUE,"
+                " row TEXT NOT NULL,"
+                " created REAL NOT NULL,"
+                " status TEXT NOT NULL DEFAULT 'pending')")
+            conn.execute("CREATE INDEX IF NOT EXISTS rows_status ON rows (status, id)")
+            self._conn = conn
+        return self._conn
+
+    def add(self, row, key):
+        """Возвращает статус записи с этим ключом (pending для новой)."""
+        with self._lock:
+            db = self._db()
+            db.execute("INSERT OR IGNORE INTO rows (key, row, created) VALUES (?, ?, ?)",
+                       (key, json.dumps(row, ensure_ascii=False), time.time()))
+            return db.execute("SELECT status FROM rows WHERE key = ?", (key,)).fetchone()[0]
+
+    def fetch(self, status, limit=None):
+        with self._lock:
+            sql = "SELECT id, key, row FROM rows WHERE status = ? ORDER BY id"
+            args = (status,)
+            if limit:
+                sql += " LIMIT ?"
+                args += (limit,)
+            return [(i, k, json.loads(r)) for i, k, r in self._db().execute(sql, args)]
+
+    def count(self, status):
+        with self._lock:
+            return self._db().execute("SELECT COUNT(*) FROM rows WHERE status = ?", (status,)).fetchone()[0]
+
+    def mark(self, ids, status):
+        with self._lock:
+            self._db().executemany("UPDATE rows SET status = ? WHERE id = ?", [(status, i) for i in ids])
+
+    def recent(self, since):
+        """Строки (created, row), принятые после since и не отклонённые Google."""
+        with self._lock:
+            cur = self._db().execute(
+                "SELECT created, row FROM rows WHERE created >= ? AND status != 'failed' ORDER BY id", (since,))
+            return [(created, json.loads(row)) for created, row in cur]
+
+    def prune(self, days=JOURNAL_KEEP_DAYS):
+        with self._lock:
+            self._db().execute("DELETE FROM rows WHERE status = 'sent' AND created < ?",
+                               (time.time() - days * 86400,))
+
+
+class SheetWriter:
+    """Фоновая запись в таблицу через локальный журнал.
+
+    submit() сразу сохраняет строку в RowJournal и возвращает Future; дальше
+    фоновый поток вычитывает журнал по порядку и отправляет пачки одним
+    append_rows — когда набралось batch_size строк или прошло flush_interval
+    секунд. Future завершится True, когда строка попала в таблицу, и False,
+    если Google отверг именно её (400). Пачка, отвергнутая с 400, делится
+    пополам и отправляется заново, пока плохая строка не останется одна, —
+    чужие строки из той же пачки от этого не страдают. Временные ошибки
+    повторяются, пока запись не пройдёт; если недоступна вся таблица (нет
+    доступа, удалена, отозван ключ), writer ждёт reconnect() или новых строк.
+    Всё это время строка лежит в журнале и переживает перезапуск процесса.
+
+    Вместе со строкой в последнюю колонку пишется её ключ. Если запрос
+    оборвался и непонятно, дошёл ли он, перед повтором ключи сверяются
+    с таблицей, чтобы не записать строку дважды.
+
+    Внутри отдельного потока крутится свой asyncio-цикл: паузы между
+    попытками — это asyncio.sleep, поэтому ни один поток не спит в ожидании
+    повтора, а обработчики Telegram просто ждут Future через wrap_future.
+
+    Подключение к таблице и проверка заголовков тоже делаются здесь, лениво:
+    бот и окно стартуют сразу, а строки, пришедшие до подключения, просто
+    ждут в журнале.
+    """
+
+    def __init__(self, journal, batch_size=SHEETS_BATCH_SIZE, flush_interval=SHEETS_FLUSH_INTERVAL,
+                 backoff_base=SHEETS_BACKOFF_BASE, backoff_max=SHEETS_BACKOFF_MAX):
+        self.journal = journal
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._loop = None
+        self._wakeup = None
+        self._waiters = {}
+        self.stuck = None  # ошибка, из-за которой writer ждёт reconnect(); None — работает
+        self._ready = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._ready.clear()
+                self._thread = threading.Thread(target=self._run, name="SheetWriterThread", daemon=True)
+                self._thread.start()
+        self._ready.wait()
+
+    def submit(self, row, key=None):
+        key = key or uuid.uuid4().hex
+        fut = concurrent.futures.Future()
+        status = self.journal.add(row, key)
+        if status in ("sent", "failed"):
+            fut.set_result(status == "sent")
+            return fut
+        with self._lock:
+            self._waiters.setdefault(key, []).append(fut)
+        self.start()
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+        return fut
+
+    def reconnect(self):
+        """Сбросить подключение (например, после смены настроек) — writer подключится заново."""
+        global sheet
+        sheet = None
+        self.start()
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _resolve(self, keys, ok):
+        with self._lock:
+            futs = [f for k in keys for f in self._waiters.pop(k, [])]
+        for fut in futs:
+            fut.set_result(ok)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._wakeup = asyncio.Event()
+        self._ready.set()
+        self._loop.run_until_complete(self._main())
+
+    async def _main(self):
+        loop = asyncio.get_running_loop()
+        self.journal.prune()
         try:
-            sheet.append_row(row, value_input_option='USER_ENTERED')
-            logger.info("Строка успешно записана (попытка %d).", attempt)
-            return True
+            await self._ensure_sheet()
         except Exception as e:
-            logger.error("Ошибка записи в Google Sheets (попытка %d): %s", attempt, e)
-            if attempt < retries:
-                time.sleep(delay)
-    return False
+            logger.error("Не удалось подключиться к Google Sheets: %s", e)
+        attempt = 0
+        while True:
+            self._wakeup.clear()
+            if not self.journal.count("pending") and not self.journal.count("sending"):
+                await self._wakeup.wait()
+            # даём пачке набраться
+            deadline = loop.time() + self.flush_interval
+            while self.journal.count("pending") < self.batch_size and loop.time() < deadline:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._ensure_sheet()
+                await self._reconcile()
+                batch = self.journal.fetch("pending", self.batch_size)
+                if batch:
+                    await self._send(batch)
+                attempt = 0
+                self.stuck = None
+            except Exception as e:
+                if not is_retryable_error(e):
+                    self.stuck = e
+                    # повтор не поможет (нет ключа, нет доступа, ошибка в коде) — строки ждут в журнале
+                    # до следующего сообщения или reconnect() после смены настроек
+                    logger.error("Google Sheets недоступен, ждём новых строк или смены настроек: %s", e)
+                    attempt = 0
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                attempt += 1
+                metrics.inc("chassbot_sheets_retries_total")
+                logger.error("Ошибка записи в Google Sheets (попытка %d): %s", attempt, e)
+                await asyncio.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_max))
+
+    async def _ensure_sheet(self):
+        global sheet
+        if sheet is not None:
+            return
+        loop = asyncio.get_running_loop()
+        ws = await loop.run_in_executor(None, connect_sheets)
+        try:
+            await loop.run_in_executor(None, ensure_headers, ws)
+        except Exception as e:
+            logger.warning("Не удалось проверить заголовки: %s", e)
+        sheet = ws
+        logger.info("Подключились к Google Sheets.")
+
+    async def _reconcile(self):
+        """Разбирает строки, застрявшие в sending: что уже есть в таблице — sent, остальное — снова pending."""
+        sending = self.journal.fetch("sending")
+        if not sending:
+            return
+        keys_in_sheet = set(await sheets_call_async(sheet.col_values, len(HEADERS)))
+        done = [(i, k) for i, k, _ in sending if k in keys_in_sheet]
+        self.journal.mark([i for i, _ in done], "sent")
+        self.journal.mark([i for i, k, _ in sending if k not in keys_in_sheet], "pending")
+        self._resolve([k for _, k in done], True)
+        if done:
+            logger.info("Уже были в таблице после обрыва: %d строк.", len(done))
+
+    async def _send(self, batch):
+        ids = [i for i, _, _ in batch]
+        keys = [k for _, k, _ in batch]
+        rows = [row + [k] for _, k, row in batch]
+        self.journal.mark(ids, "sending")
+        try:
+            # сам HTTP-запрос gspread блокирующий, поэтому он в executor, а паузы — нет
+            with perf_stats.span("sheets.append", rows=len(rows)):
+                await sheets_call_async(sheet.append_rows, rows, value_input_option='USER_ENTERED')
+        except Exception as e:
+            if is_retryable_error(e):
+                raise  # строки остаются в sending и будут сверены перед повтором
+            if error_status(e) == 400 and len(batch) > 1:
+                # 400 — Google не принял содержимое пачки: делим её пополам, чтобы одна
+                # плохая строка не утянула чужие; другие ошибки делением не лечатся
+                logger.warning("Google отверг пачку из %d строк, отправляем по частям: %s", len(batch), e)
+                self.journal.mark(ids, "pending")
+                half = len(batch) // 2
+                await self._send(batch[:half])
+                await self._send(batch[half:])
+                return
+            if error_status(e) != 400:
+                # таблица недоступна целиком (401/403/404, отозван ключ, ошибка в коде) — строки
+                # ни при чём: возвращаем их в журнал, _main дождётся reconnect() или новых строк
+                self.journal.mark(ids, "pending")
+                raise
+            logger.error("Google отверг строку: %s", e)
+            metrics.inc("chassbot_sheets_rows_total", len(rows), result="failed")
+            self.journal.mark(ids, "failed")
+            self._resolve(keys, False)
+            return
+        self.journal.mark(ids, "sent")
+        self._resolve(keys, True)
+        metrics.inc("chassbot_sheets_rows_total", len(rows), result="sent")
+        logger.info("Записано строк: %d.", len(rows))
+
+
+sheet_writer = SheetWriter(RowJournal())
+
+
+# ===========================
+# ПОВТОРНЫЕ ОТЧЁТЫ
+# ===========================
+class DuplicateIndex:
+    """Индекс недавних отчётов: шасси + нормализованный текст поломки → время.
+
+    Водители часто присылают одно и то же дважды (текстом и голосом или
+    повторно после «⚠»). Если тот же отчёт по тому же шасси уже был в
+    пределах окна, второй раз в таблицу его не пишем. Индекс живёт в памяти,
+    а при первом обращении восстанавливается из журнала — отдельного файла
+    для него не нужно.
+    """
+
+    def __init__(self, journal, window_min=DEDUP_WINDOW_MIN):
+        self.journal = journal
+        self.window_min = window_min
+        self._seen = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(row):
+        """Ключ по строке из make_row; без номера шасси отчёты не сравниваем."""
+        chassis, failure, description = row[2], row[4], row[5]
+        if not chassis:
+            return None
+        words = re.findall(r"\w+", (failure or description).lower())
+        return f"{chassis}|{' '.join(words)}"
+
+    def _load(self):
+        self._seen = {}
+        since = time.time() - self.window_min * 60
+        for created, row in self.journal.recent(since):
+            key = self.make_key(row)
+            if key:
+                self._seen[key] = max(created, self._seen.get(key, 0))
+        logger.info("Индекс повторов восстановлен из журнала: %d записей.", len(self._seen))
+
+    def check_and_add(self, row):
+        """True, если такой отчёт уже был в окне; иначе запоминает его и возвращает False."""
+        key = self.make_key(row)
+        if key is None:
+            return False
+        now = time.time()
+        with self._lock:
+            if self._seen is None:
+                self._load()
+            cutoff = now - self.window_min * 60
+            if self._seen.get(key, 0) >= cutoff:
+                return True
+            if len(self._seen) > 10000:
+                self._seen = {k: t for k, t in self._seen.items() if t >= cutoff}
+            self._seen[key] = now
+            return False
+
+    def discard(self, row):
+        key = self.make_key(row)
+        with self._lock:
+            if key and self._seen:
+                self._seen.pop(key, None)
+
+
+duplicate_index = DuplicateIndex(sheet_writer.journal)
 
 
 # ===========================
 # ПАРСЕР СООБЩЕНИЙ
 # ===========================
+# Все регулярки парсера компилируются один раз при импорте.
+# Марки техники: как их ищет парсер (в порядке приоритета) → как писать в нормализованном
+# тексте голосовых. Общая таблица для парсера и нормализатора — новую марку добавлять сюда.
+BRANDS = {
+    "белаз": "БелАЗ", "cat": "CAT", "volvo": "Volvo", "komatsu": "Komatsu", "dumper": "dumper",
+    "камаз": "КамАЗ", "shacman": "Shacman", "moxy": "Moxy", "terex": "Terex",
+}
+MODEL_CANDIDATES = list(BRANDS)
+_MODEL_RANK = {cand: i for i, cand in enumerate(MODEL_CANDIDATES)}
+
+_ORG_RE = re.compile(r"^(.*?)\s*(?:шасси|на\s|—|-|–|:|,?\s*где|,?\s*в)\b")
+_ORG_FALLBACK_RE = re.compile(r"^(.*?)[,;]")
+_CHASSIS_RE = re.compile(r"шасси\s*[:\s]?\s*(\d+)")
+_MODEL_RE = re.compile(r"\b(" + "|".join(map(re.escape, MODEL_CANDIDATES)) + r")\b")
+_KM_RE = re.compile(r"(\d{2,7})\s*км\b")
+_HOURS_RE = re.compile(r"(\d{1,6})\s*ч\b")
+
+# Ключевые слова поломок ищем одним проходом (lookahead — чтобы не терять
+# пересекающиеся вхождения), а полные шаблоны примеряем только в этих позициях.
+_FAILURE_KEYWORDS_RE = re.compile(r"(?=(защита|ошибка|отказ))")
+_FAILURE_PATTERNS = [
+    ("защита", re.compile(r"защита[:\s]*([^\.,;]+)")),
+    ("ошибка", re.compile(r"ошибка[:\s]*([^\.,;]+)")),
+    ("ошибка", re.compile(r"ошибка\s+([^\.,;]+)")),
+    ("отказ", re.compile(r"отказ[:\s]*([^\.,;]+)")),
+]
+
+# Для чистки описания: общий шаблон + проверка цифр в колбэке вместо
+# компиляции отдельной регулярки под каждое найденное значение.
+_CHASSIS_DESC_RE = re.compile(r"шасси\s*[:\s]?\s*(\d+)", re.IGNORECASE)
+_KM_DESC_RE = re.compile(r"(\d+)\s*км", re.IGNORECASE)
+_HOURS_DESC_RE = re.compile(r"(\d+)\s*ч", re.IGNORECASE)
+_DESC_LEAD_RE = re.compile(r"^[\s,;:\-]+")
+
+
+def _find_failures(text_l):
+    positions = {}
+    for m in _FAILURE_KEYWORDS_RE.finditer(text_l):
+        positions.setdefault(m.group(1), []).append(m.start())
+    failures = []
+    if not positions:
+        return failures
+    for keyword, pattern in _FAILURE_PATTERNS:
+        # то же, что pattern.finditer(text_l), но только с позиций ключевого слова
+        next_pos = 0
+        for pos in positions.get(keyword, ()):
+            if pos < next_pos:
+                continue
+            m = pattern.match(text_l, pos)
+            if m:
+                failures.append(m.group(0).strip())
+                next_pos = m.end()
+    return failures
+
+
 def parse_message(text: str):
     text_orig = (text or "").strip()
     text_l = text_orig.lower()
+    # обычно lower() не меняет длину, и позиции в text_l совпадают с text_orig
+    same_layout = len(text_l) == len(text_orig)
 
     org = ""
-    m_org = re.search(r"^(.*?)\s*(?:шасси|на\s|—|-|–|:|,?\s*где|,?\s*в)\b", text_l)
+    m_org = _ORG_RE.search(text_l)
     if m_org:
         org = m_org.group(1).strip()
     else:
-        m = re.match(r"^(.*?)[,;]", text_orig)
+        m = _ORG_FALLBACK_RE.match(text_orig)
         org = m.group(1).strip() if m else ""
 
     if org:
-        pattern = re.compile(re.escape(org), re.IGNORECASE)
-        m_orig = pattern.search(text_orig)
-        org = m_orig.group(0).strip() if m_orig else org
+        if same_layout:
+            # организация всегда в самом начале текста
+            org = text_orig[:len(org)]
+        else:
+            m_orig = re.search(re.escape(org), text_orig, re.IGNORECASE)
+            org = m_orig.group(0).strip() if m_orig else org
 
     date_str = datetime.now(timezone.utc).astimezone().strftime("%Y-%m-%d %H:%M:%S %Z")
 
-    m_chassis = re.search(r"шасси\s*[:\s]?\s*(\d+)", text_l)
+    m_chassis = _CHASSIS_RE.search(text_l)
     chassis = m_chassis.group(1) if m_chassis else ""
 
+    # кандидат из начала списка важнее, даже если в тексте он встретился позже
     model = ""
-    model_candidates = ["белаз", "cat", "volvo", "komatsu", "dumper", "камаз", "shacman", "moxy", "terex"]
-    for cand in model_candidates:
-        if re.search(r"\b" + re.escape(cand) + r"\b", text_l):
-            m_mod = re.search(r"\b(" + re.escape(cand) + r")\b", text_orig, re.IGNORECASE)
-            model = m_mod.group(1) if m_mod else cand
-            break
+    best = None
+    for m in _MODEL_RE.finditer(text_l):
+        rank = _MODEL_RANK[m.group(1)]
+        if best is None or rank < _MODEL_RANK[best.group(1)]:
+            best = m
+    if best:
+        if same_layout:
+            model = text_orig[best.start(1):best.end(1)]
+        else:
+            m_mod = re.search(r"\b(" + re.escape(best.group(1)) + r")\b", text_orig, re.IGNORECASE)
+            model = m_mod.group(1) if m_mod else best.group(1)
 
     km = None
     hours = None
-    m_km = re.search(r"(\d{2,7})\s*км\b", text_l)
+    m_km = _KM_RE.search(text_l)
     if m_km:
         km = m_km.group(1)
-    m_h = re.search(r"(\d{1,6})\s*ч\b", text_l)
+    m_h = _HOURS_RE.search(text_l)
     if m_h:
         hours = m_h.group(1)
 
@@ -167,23 +877,27 @@ def parse_message(text: str):
             mileage_hours += ", "
         mileage_hours += f"{hours} ч"
 
-    failures = []
-    for pat in [r"защита[:\s]*([^\.,;]+)", r"ошибка[:\s]*([^\.,;]+)", r"ошибка\s+([^\.,;]+)", r"отказ[:\s]*([^\.,;]+)"]:
-        for m in re.finditer(pat, text_l):
-            failures.append(m.group(0).strip())
-    failures = list(dict.fromkeys(failures))
+    failures = list(dict.fromkeys(_find_failures(text_l)))
     failure_text = "; ".join(failures)
 
     description = text_orig
     if org:
-        description = re.sub(re.compile(re.escape(org), re.IGNORECASE), "", description, count=1).strip()
+        if same_layout:
+            description = description[len(org):].strip()
+        else:
+            description = re.sub(re.escape(org), "", description, count=1, flags=re.IGNORECASE).strip()
     if chassis:
-        description = re.sub(re.compile(r"шасси\s*[:\s]?\s*" + re.escape(chassis), re.IGNORECASE), "", description)
+        # убираем "шасси N"; если номер длиннее N, хвост цифр остаётся
+        description = _CHASSIS_DESC_RE.sub(
+            lambda m: m.group(1)[len(chassis):] if m.group(1).startswith(chassis) else m.group(0),
+            description)
     if km:
-        description = re.sub(re.compile(re.escape(km) + r"\s*км", re.IGNORECASE), "", description)
+        description = _KM_DESC_RE.sub(
+            lambda m: m.group(1)[:-len(km)] if m.group(1).endswith(km) else m.group(0), description)
     if hours:
-        description = re.sub(re.compile(re.escape(hours) + r"\s*ч", re.IGNORECASE), "", description)
-    description = re.sub(r"^[\s,;:\-]+", "", description).strip()
+        description = _HOURS_DESC_RE.sub(
+            lambda m: m.group(1)[:-len(hours)] if m.group(1).endswith(hours) else m.group(0), description)
+    description = _DESC_LEAD_RE.sub("", description).strip()
 
     return {
         "organization": org,
@@ -195,6 +909,51 @@ def parse_message(text: str):
         "mileage_hours": mileage_hours
     }
 
+def _parse_chunk(texts):
+    return [parse_message(text) for text in texts]
+
+def _pool_can_import():
+    """Найдёт ли процесс пула _parse_chunk.
+
+    При fork модуль уже в памяти ребёнка; при spawn/forkserver ребёнок
+    импортирует его заново по имени, а модуль, загруженный через
+    spec_from_file_location под выдуманным именем, так не найти.
+    """
+    if __name__ in ("__main__", "__mp_main__") or multiprocessing.get_start_method() == "fork":
+        return True
+    return importlib.machinery.PathFinder.find_spec(__name__) is not None
+
+
+def parse_messages(texts, processes=None, chunksize=PARSE_CHUNK_SIZE):
+    """Разбирает поток сообщений, отдавая результаты лениво и в исходном порядке.
+
+    processes=1 — всё в текущем процессе; None — пул на все ядра. Вход читается
+    кусками по chunksize, и в работе держится не больше двух кусков на процесс,
+    так что даже очень длинная история не загружается в память целиком.
+    Если процессы пула не смогут импортировать этот модуль, разбор идёт
+    в текущем процессе.
+    """
+    if processes != 1 and not _pool_can_import():
+        logger.warning("Модуль %s не импортируется в процессах пула, разбираем в одном процессе.", __name__)
+        processes = 1
+    if processes == 1:
+        for text in texts:
+            yield parse_message(text)
+        return
+    processes = processes or os.cpu_count() or 1
+    it = iter(texts)
+    pending = collections.deque()
+    with multiprocessing.Pool(processes) as pool:
+        while True:
+            while len(pending) < processes * 2:
+                chunk = list(itertools.islice(it, chunksize))
+                if not chunk:
+                    break
+                pending.append(pool.apply_async(_parse_chunk, (chunk,)))
+            if not pending:
+                break
+            yield from pending.popleft().get()
+
 def make_row(parsed: dict):
     return [
         parsed["organization"],
@@ -206,6 +965,270 @@ def make_row(parsed: dict):
         parsed["mileage_hours"]
     ]
 
+# ===========================
+# ГОЛОСОВЫЕ СООБЩЕНИЯ
+# ===========================
+def decode_voice(data: bytes) -> bytes:
+    """OGG/Opus → сырой PCM (s16le, 16 кГц, моно) через пайп ffmpeg, без временных файлов.
+
+    Заодно обрезаем тишину по краям и выравниваем громкость (VOICE_AUDIO_FILTER),
+    так что распознавание всегда получает один и тот же формат.
+    """
+    filters = ["-af", VOICE_AUDIO_FILTER] if VOICE_AUDIO_FILTER else []
+    proc = subprocess.run(
+        [AudioSegment.converter, "-hide_banner", "-loglevel", "error",
+         "-i", "pipe:0", *filters,
+         "-f", "s16le", "-acodec", "pcm_s16le",
+         "-ac", str(VOICE_CHANNELS), "-ar", str(VOICE_SAMPLE_RATE),
+         "pipe:1"],
+        input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg: {proc.stderr.decode(errors='replace').strip()}")
+    return proc.stdout
+
+
+class SpeechBackend:
+    """Движок распознавания: получает sr.AudioData, возвращает текст или бросает исключение."""
+    name = ""
+
+    def recognize(self, audio_data) -> str:
+        raise NotImplementedError
+
+
+class GoogleSpeechBackend(SpeechBackend):
+    name = "google"
+
+    def __init__(self):
+        self._recognizer = sr.Recognizer()
+
+    def recognize(self, audio_data) -> str:
+        return self._recognizer.recognize_google(audio_data, language=ASR_LANGUAGE)
+
+
+class VoskSpeechBackend(SpeechBackend):
+    """Офлайн-распознавание на CPU. Модель грузится один раз на процесс и дальше держится в памяти."""
+    name = "vosk"
+    sample_rate = 16000
+
+    def __init__(self):
+        if not HAS_VOSK:
+            raise RuntimeError("пакет vosk не установлен")
+        vosk.SetLogLevel(-1)
+        self._model = vosk.Model(VOSK_MODEL_PATH)
+
+    def recognize(self, audio_data) -> str:
+        rec = vosk.KaldiRecognizer(self._model, self.sample_rate)
+        rec.AcceptWaveform(audio_data.get_raw_data(convert_rate=self.sample_rate, convert_width=2))
+        text = json.loads(rec.FinalResult()).get("text", "")
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+
+SPEECH_BACKENDS = {
+    GoogleSpeechBackend.name: GoogleSpeechBackend,
+    VoskSpeechBackend.name: VoskSpeechBackend,
+}
+_speech_backends = {}  # уже созданные движки этого процесса
+
+def get_speech_backend(name):
+    if name not in _speech_backends:
+        _speech_backends[name] = SPEECH_BACKENDS[name]()
+    return _speech_backends[name]
+
+def warm_up_speech_backends(names):
+    """Инициализатор процесса пула: заранее загружаем модели, чтобы первое голосовое не ждало."""
+    for name in names:
+        try:
+            get_speech_backend(name)
+        except Exception as e:
+            logger.warning("Движок распознавания %s недоступен: %s", name, e)
+
+def recognize_speech(audio_data, backends) -> str:
+    """Пробует движки по порядку и возвращает первый успешный результат."""
+    errors = []
+    for name in backends:
+        try:
+            return get_speech_backend(name).recognize(audio_data)
+        except Exception as e:
+            errors.append(f"{name}: {str(e) or type(e).__name__}")
+    raise RuntimeError("; ".join(errors) or "не настроен ни один движок распознавания")
+
+
+def split_voice(data: bytes) -> list:
+    """Декодирует голосовое и режет его по паузам на куски PCM не длиннее VOICE_CHUNK_MAX_SEC.
+
+    Соседние фразы склеиваются, пока влезают в лимит; фраза длиннее лимита
+    без единой паузы режется просто по длине. Короткие голосовые не режутся.
+    Выполняется в процессе пула.
+    """
+    pcm = decode_voice(data)
+    audio = AudioSegment(data=pcm, sample_width=VOICE_SAMPLE_WIDTH,
+                         frame_rate=VOICE_SAMPLE_RATE, channels=VOICE_CHANNELS)
+    max_ms = VOICE_CHUNK_MAX_SEC * 1000
+    if len(audio) <= max_ms or audio.rms == 0:
+        return [pcm]
+    ranges = detect_nonsilent(audio, min_silence_len=VOICE_SILENCE_MIN_MS,
+                              silence_thresh=audio.dBFS - VOICE_SILENCE_DB, seek_step=10)
+    if not ranges:
+        return [pcm]
+
+    spans = []
+    start, end = ranges[0]
+    for s, e in ranges[1:]:
+        if e - start + 2 * VOICE_CHUNK_PAD_MS <= max_ms:
+            end = e
+        else:
+            spans.append((start, end))
+            start, end = s, e
+    spans.append((start, end))
+
+    chunks = []
+    for start, end in spans:
+        start = max(0, start - VOICE_CHUNK_PAD_MS)
+        end = min(len(audio), end + VOICE_CHUNK_PAD_MS)
+        for pos in range(start, end, max_ms):
+            chunks.append(audio[pos:min(end, pos + max_ms)].raw_data)
+    return chunks
+
+
+def transcribe_pcm(pcm: bytes, backends) -> str:
+    """Распознавание одного куска PCM — выполняется в процессе пула."""
+    audio_data = sr.AudioData(pcm, VOICE_SAMPLE_RATE, VOICE_SAMPLE_WIDTH)
+    return recognize_speech(audio_data, backends)
+
+
+class VoiceQueueFull(Exception):
+    pass
+
+
+class VoiceQueue:
+    """Пул процессов для голосовых с ограниченной очередью.
+
+    Перекодирование и распознавание уходят из event loop в отдельные
+    процессы, одновременно работают не больше workers штук. Если в очереди
+    уже max_pending голосовых, новые не принимаем (VoiceQueueFull), чтобы
+    не копить бесконечный хвост. Вызывается только из event loop бота,
+    поэтому счётчик не требует блокировок.
+    """
+
+    def __init__(self, workers=VOICE_WORKERS, max_pending=VOICE_QUEUE_MAX):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._pool = None
+
+    def enter(self):
+        """Занимает место в очереди и возвращает номер в ней (0 — обработка начнётся сразу)."""
+        if self.pending >= self.max_pending:
+            raise VoiceQueueFull()
+        self.pending += 1
+        return max(0, self.pending - self.workers)
+
+    def leave(self):
+        self.pending -= 1
+
+    async def run(self, func, *args, stage=None):
+        """func(*args) в процессе пула; со stage в PerfStats пишутся время работы и ожидания в очереди."""
+        if self._pool is None:
+            # spawn, а не fork: в процессе уже крутятся потоки бота, writer'а и Tk
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                initializer=warm_up_speech_backends, initargs=(ASR_BACKENDS,))
+        loop = asyncio.get_running_loop()
+        if stage is None:
+            return await loop.run_in_executor(self._pool, func, *args)
+        t0 = time.perf_counter()
+        result, worked = await loop.run_in_executor(self._pool, timed_call, func, *args)
+        perf_stats.add(stage, worked)
+        perf_stats.add(stage + ".wait", time.perf_counter() - t0 - worked)
+        return result
+
+
+voice_queue = VoiceQueue()
+
+
+async def transcribe_voice(data: bytes, backends, on_partial=None) -> str:
+    """Распознаёт голосовое по кускам: все куски уходят в пул сразу, текст собирается по порядку.
+
+    Время ответа определяется самым долгим куском, а не длиной всей записи.
+    on_partial(text) вызывается с уже готовым началом текста, пока остальные
+    куски ещё распознаются. Кусок, в котором ничего не разобрали, пропускается;
+    ошибка — только если не разобрали ни одного.
+    """
+    chunks = await voice_queue.run(split_voice, data, stage="voice.decode")
+    jobs = [asyncio.ensure_future(voice_queue.run(transcribe_pcm, pcm, backends, stage="voice.asr"))
+            for pcm in chunks]
+    texts, errors = [], []
+    for i, job in enumerate(jobs):
+        try:
+            texts.append(await job)
+        except Exception as e:
+            errors.append(str(e))
+        if on_partial is not None and texts and i < len(jobs) - 1:
+            await on_partial(" ".join(texts))
+    if not texts:
+        raise RuntimeError("; ".join(errors))
+    return " ".join(texts)
+
+
+class TranscriptCache:
+    """Кэш распознанного текста голосовых (SQLite), чтобы не распознавать одно и то же дважды.
+
+    Ключи — file_unique_id от Telegram (пересланное голосовое сохраняет его)
+    и sha256 самого файла. Хранится уже нормализованный текст. Старше
+    max_age_days записи удаляются, а сверх max_entries вытесняются те,
+    к которым дольше всего не обращались (LRU).
+    """
+
+    def __init__(self, path=VOICE_CACHE_FILE, max_entries=VOICE_CACHE_MAX_ENTRIES,
+                 max_age_days=VOICE_CACHE_MAX_AGE_DAYS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS transcripts ("
+                " key TEXT PRIMARY KEY,"
+                " text TEXT NOT NULL,"
+                " created REAL NOT NULL,"
+                " used REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS transcripts_used ON transcripts (used)")
+            self._conn = conn
+        return self._conn
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            found = db.execute("SELECT text FROM transcripts WHERE key = ? AND created >= ?",
+                               (key, now - self.max_age_days * 86400)).fetchone()
+            if found is None:
+                return None
+            db.execute("UPDATE transcripts SET used = ? WHERE key = ?", (now, key))
+            return found[0]
+
+    def put(self, keys, text):
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.executemany("INSERT OR REPLACE INTO transcripts (key, text, created, used) VALUES (?, ?, ?, ?)",
+                           [(key, text, now, now) for key in keys])
+            db.execute("DELETE FROM transcripts WHERE created < ?", (now - self.max_age_days * 86400,))
+            db.execute("DELETE FROM transcripts WHERE key IN ("
+                       " SELECT key FROM transcripts ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                       (self.max_entries,))
+
+
+transcript_cache = TranscriptCache()
+
+
 # ===========================
 # TELEGRAM BOT
 # ===========================
@@ -217,45 +1240,135 @@ async def process_text(update: Update, context: ContextTypes.DEFAULT_TYPE, text:
     if not text:
         await update.message.reply_text("Пожалуйста, пришлите текст или голосовое сообщение.")
         return
-    parsed = parse_message(text)
-    row = make_row(parsed)
-    loop = asyncio.get_running_loop()
-    ok = await loop.run_in_executor(None, append_row_with_retry, row)
-    if ok:
-        await update.message.reply_text(f"✅ Данные записаны.\nРаспознанный текст: {text}")
-    else:
+    chat_id = update.effective_chat.id
+    with perf_stats.span("parse", chat=chat_id):
+        parsed = parse_message(text)
+        row = make_row(parsed)
+    # ключ из chat_id/message_id: повторная доставка того же апдейта не даст дубль
+    key = f"tg:{chat_id}:{update.message.message_id}"
+    if duplicate_index.check_and_add(row):
+        logger.info("Повторный отчёт по шасси %s пропущен.", parsed["chassis"])
+        await update.message.reply_text(
+            f"ℹ Такой отчёт по шасси {parsed['chassis']} уже записан "
+            f"за последние {duplicate_index.window_min} мин — повторно не добавляю.")
+        return
+    try:
+        with perf_stats.span("journal", chat=chat_id):
+            future = sheet_writer.submit(row, key)
+        # полное время до строки в таблице — с ожиданием пачки, лимита и повторов
+        submitted = time.perf_counter()
+        future.add_done_callback(
+            lambda f: perf_stats.add("sheets.total", time.perf_counter() - submitted, chat=chat_id))
+    except Exception as e:
+        duplicate_index.discard(row)
+        logger.error("Не удалось сохранить строку в журнал: %s", e)
         await update.message.reply_text("⚠ Ошибка записи в таблицу.")
+        return
+    # отвечаем сразу, не дожидаясь таблицы, а итог дописываем в то же сообщение
+    preview = format_preview(parsed, text)
+    with perf_stats.span("tg.reply", chat=chat_id):
+        reply = await update.message.reply_text(f"⏳ Сохраняю...\n{preview}")
+    context.application.create_task(confirm_saved(reply, future, row, preview), update=update)
+
+
+def format_preview(parsed, text):
+    return (f"Шасси: {parsed['chassis'] or '—'}, модель: {parsed['model'] or '—'}\n"
+            f"Неисправность: {parsed['failure'] or '—'}\n"
+            f"Пробег / моточасы: {parsed['mileage_hours'] or '—'}\n"
+            f"Распознанный текст: {text}")
+
+
+async def confirm_saved(reply, future, row, preview):
+    """Ждёт SheetWriter и меняет «⏳ Сохраняю» на ✅ или ⚠ в том же сообщении."""
+    waiting = asyncio.wrap_future(future)
+    try:
+        try:
+            ok = await asyncio.wait_for(asyncio.shield(waiting), SAVE_CONFIRM_TIMEOUT)
+        except asyncio.TimeoutError:
+            await reply.edit_text(f"🕓 Таблица отвечает медленно. Отчёт сохранён и будет записан, "
+                                  f"повторно присылать не нужно.\n{preview}")
+            ok = await waiting
+        if ok:
+            await reply.edit_text(f"✅ Записано в таблицу.\n{preview}")
+        else:
+            duplicate_index.discard(row)  # не записали — повторная отправка не должна считаться дублем
+            await reply.edit_text(f"⚠ Google отклонил запись, отчёт не сохранён.\n{preview}")
+    except Exception as e:
+        logger.warning("Не удалось обновить ответ о записи: %s", e)
 
 
 async def tg_handle(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    metrics.inc("chassbot_updates_total", handler="tg_handle")
     text = (update.message.text or "").strip()
     await process_text(update, context, text)
 
 async def tg_handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    metrics.inc("chassbot_updates_total", handler="tg_handle_voice")
     voice = update.message.voice
-    file = await context.bot.get_file(voice.file_id)
+    # пересланное голосовое уже распознавали — не качаем его повторно
+    id_key = f"fid:{voice.file_unique_id}"
+    text = transcript_cache.get(id_key)
+    if text is not None:
+        await process_text(update, context, text)
+        return
+
+    chat_id = update.effective_chat.id
+    with perf_stats.span("tg.get_file", chat=chat_id):
+        file = await context.bot.get_file(voice.file_id)
+
+    # всё в памяти: скачиваем в буфер, декодируем через пайп ffmpeg, PCM — сразу в распознавание
+    with perf_stats.span("tg.download", chat=chat_id, size=voice.file_size, duration=voice.duration):
+        data = bytes(await file.download_as_bytearray())
+    content_key = f"sha:{hashlib.sha256(data).hexdigest()}"
+    text = transcript_cache.get(content_key)
+    if text is not None:
+        transcript_cache.put([id_key], text)
+        await process_text(update, context, text)
+        return
 
-    # временный файл
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".ogg") as f:
-        ogg_path = f.name
-        await file.download_to_drive(ogg_path)
+    try:
+        place = voice_queue.enter()
+    except VoiceQueueFull:
+        await update.message.reply_text(
+            "⏳ Сейчас слишком много голосовых. Пришлите ещё раз через пару минут или напишите текстом.")
+        return
+    if place:
+        await update.message.reply_text(f"⏳ Голосовое принято, вы №{place} в очереди на распознавание.")
+    # ждём распознавание здесь же: следующее сообщение этого водителя встанет в очередь чата
+    # и попадёт в таблицу после голосового; другие чаты обрабатываются параллельно,
+    # а декодирование и распознавание идут в пуле процессов
+    await recognize_and_process(update, context, data, [id_key, content_key])
 
-    wav_path = ogg_path.replace(".ogg", ".wav")
-    AudioSegment.from_file(ogg_path).export(wav_path, format="wav")
 
-    recognizer = sr.Recognizer()
+async def recognize_and_process(update: Update, context: ContextTypes.DEFAULT_TYPE, data: bytes, cache_keys):
+    progress = None
+
+    async def show_partial(text):
+        # промежуточный текст только показываем: в таблицу уходит одна строка по всему голосовому
+        nonlocal progress
+        preview = f"🎙 Распознаю дальше...\n{text}"
+        try:
+            if progress is None:
+                progress = await update.message.reply_text(preview)
+            else:
+                await progress.edit_text(preview)
+        except Exception as e:
+            logger.warning("Не удалось показать промежуточный текст: %s", e)
+
+    recognized = False
     try:
-        with sr.AudioFile(wav_path) as source:
-            audio_data = recognizer.record(source)
-            text = recognizer.recognize_google(audio_data, language="ru-RU")
+        with perf_stats.span("voice.total", chat=update.effective_chat.id):
+            text = await transcribe_voice(data, ASR_BACKENDS, show_partial)
+        recognized = True
     except Exception as e:
         text = f"Ошибка распознавания: {e}"
-
-    os.remove(ogg_path)
-    os.remove(wav_path)
+    finally:
+        voice_queue.leave()
 
     # 🔹 нормализация текста перед обработкой
     text = normalize_recognized_text(text)
+    if recognized:
+        transcript_cache.put(cache_keys, text)
 
     await process_text(update, context, text)
 
@@ -263,34 +1376,561 @@ async def tg_handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ===========================
 # НОРМАЛИЗАЦИЯ РАСПОЗНАННОГО ТЕКСТА
 # ===========================
+# Слово (в нижнем регистре) → замена. "*" на конце — любое окончание.
+# Марки из BRANDS добавляются сами; здесь — то, как их и прочие слова слышит распознавание.
+# Дополняется из config.json ("VOCABULARY").
+VOCABULARY = {
+    "белас": "БелАЗ", "камас": "КамАЗ", "вольво": "Volvo", "комацу": "Komatsu",
+    "катерпиллер": "CAT", "терекс": "Terex", "шакман": "Shacman", "мокси": "Moxy",
+    "шаси": "шасси", "шосси": "шасси",
+}
+# Единицы меняем только сразу после числа: "3400 часов" → "3400 ч", а "через час" не трогаем.
+# "Час"/"часа" — это время ("два часа стоит", "в три часа ночи"), а не моточасы, поэтому их здесь нет.
+# Дополняется из config.json ("UNITS").
+UNITS = {"часов": "ч", "моточас*": "ч", "километр*": "км"}
+
+# Числительное → (значение, ранг, что может идти следом).
+# Ранг 0 — тысяча/миллион; остальное продолжает число, только если ранг не больше,
+# чем разрешило предыдущее слово: "сто" (2) → "двадцать" (2) → "три" (1) → конец (0).
+# "Ноль" (ранг 4) ничего не продолжает и ничем не продолжается: "двести ноль" — это 200 и 0.
+NUMBER_WORDS = {"ноль": (0, 4, 0)}
+for _value, _words in enumerate([("один", "одна", "одно"), ("два", "две"), ("три",), ("четыре",),
+                                 ("пять",), ("шесть",), ("семь",), ("восемь",), ("девять",)], 1):
+    NUMBER_WORDS.update(dict.fromkeys(_words, (_value, 1, 0)))
+for _value, _word in enumerate(["десять", "одиннадцать", "двенадцать", "тринадцать", "четырнадцать",
+                                "пятнадцать", "шестнадцать", "семнадцать", "восемнадцать", "девятнадцать"], 10):
+    NUMBER_WORDS[_word] = (_value, 2, 0)
+for _value, _word in zip(range(20, 100, 10), ["двадцать", "тридцать", "сорок", "пятьдесят",
+                                              "шестьдесят", "семьдесят", "восемьдесят", "девяносто"]):
+    NUMBER_WORDS[_word] = (_value, 2, 1)
+for _value, _word in zip(range(100, 1000, 100), ["сто", "двести", "триста", "четыреста", "пятьсот",
+                                                 "шестьсот", "семьсот", "восемьсот", "девятьсот"]):
+    NUMBER_WORDS[_word] = (_value, 3, 2)
+NUMBER_WORDS.update(dict.fromkeys(["тысяча", "тысячи", "тысяч", "тысячу"], (1000, 0, 3)))
+NUMBER_WORDS.update(dict.fromkeys(["миллион", "миллиона", "миллионов"], (1000000, 0, 3)))
+
+
+def spell_numbers(words):
+    """Числительные (и число цифрами в начале) → числа: "двадцать три тысячи триста десять" → [23310].
+
+    Слово, которое не может продолжить текущее число, начинает новое:
+    "семьсот семьдесят три двадцать три тысячи" → [773, 23000].
+    """
+    numbers = []
+    total = group = 0
+    allow, scale, fresh = 3, None, True
+    for word in words:
+        value, rank, after = (int(word), 3, 0) if word.isdigit() else NUMBER_WORDS[word]
+        if rank == 0:
+            fits = (group or fresh) and (scale is None or value < scale)
+        else:
+            fits = rank <= allow
+        if not fits and not fresh:
+            numbers.append(total + group)
+            total = group = 0
+            allow, scale = 3, None
+        if rank == 0:
+            total += (group or 1) * value
+            group, scale = 0, value
+        else:
+            group += value
+        allow, fresh = after, False
+    numbers.append(total + group)
+    return numbers
+
+
+def _alternation(words):
+    """Слова для регулярки: длинные раньше коротких, "стем*" — с любым окончанием."""
+    parts = [re.escape(w[:-1]) + r"\w*" if w.endswith("*") else re.escape(w)
+             for w in sorted(words, key=len, reverse=True)]
+    return "(?:" + "|".join(parts) + ")"
+
+
+class TextNormalizer:
+    """Нормализация распознанного текста за один проход одной скомпилированной регуляркой.
+
+    Каждое совпадение — либо число (цифрами или словами) с необязательной
+    единицей после него, либо слово из словаря; что подставить, решает колбэк.
+    """
+
+    def __init__(self, words, units):
+        self.words = {}
+        self.units = {}
+        self.extend(words, units)
+
+    def extend(self, words=None, units=None):
+        self.words.update({k.lower(): v for k, v in (words or {}).items()})
+        self.units.update({k.lower(): v for k, v in (units or {}).items()})
+        self._stems = {table_id: [(k[:-1], v) for k, v in table.items() if k.endswith("*")]
+                       for table_id, table in (("words", self.words), ("units", self.units))}
+        number_word = _alternation(NUMBER_WORDS) + r"\b"
+        self._re = re.compile(
+            r"\b(?:(?P<number>(?:\d+|" + number_word + r")(?:\s+" + number_word + r")*)"
+            r"(?:\s*(?P<unit>" + _alternation(self.units) + r"))?"
+            r"|(?P<word>" + _alternation(self.words) + r"))\b")
+
+    def _lookup(self, table_id, word):
+        table = self.words if table_id == "words" else self.units
+        if word in table:
+            return table[word]
+        for stem, value in self._stems[table_id]:
+            if word.startswith(stem):
+                return value
+        return word
+
+    def _replace(self, m):
+        number, unit, word = m.group("number", "unit", "word")
+        if word is not None:
+            return self._lookup("words", word)
+        if not number.isdigit():
+            number = " ".join(map(str, spell_numbers(number.split())))
+        if unit is None:
+            return number
+        return f"{number} {self._lookup('units', unit)}"
+
+    def normalize(self, text: str) -> str:
+        return self._re.sub(self._replace, text.lower()).strip()
+
+
+text_normalizer = TextNormalizer({**BRANDS, **VOCABULARY}, UNITS)
+
+
 def normalize_recognized_text(text: str) -> str:
-    text = text.lower()
+    return text_normalizer.normalize(text)
+
+
+def format_perf_report():
+    lines = [f"{'стадия':<16}{'кол-во':>7}{'p50':>8}{'p95':>8}{'p99':>8}  мс"]
+    for stage, st in sorted(perf_stats.summary().items()):
+        lines.append(f"{stage:<16}{st['count']:>7}"
+                     f"{st['p50'] * 1000:>8.0f}{st['p95'] * 1000:>8.0f}{st['p99'] * 1000:>8.0f}")
+    limiter = sheets_limiter.stats()
+    updates = update_processor.stats()
+    lines += [
+        "",
+        f"Sheets: {limiter['per_minute']}/мин, токенов {limiter['tokens']}, "
+        f"ждали {limiter['waited']} раз ({limiter['wait_seconds']} с)",
+        f"Журнал: ждут отправки {sheet_writer.journal.count('pending') + sheet_writer.journal.count('sending')}",
+        f"Голосовые: в обработке {voice_queue.pending} из {voice_queue.max_pending}",
+        f"Апдейты: выполняются {updates['running']} из {update_processor.max_concurrent_updates}, "
+        f"ждут {updates['waiting']} (самая длинная очередь чата — {updates['longest_chat_queue']})",
+    ]
+    return "\n".join(lines)
 
-    # исправляем типичные ошибки распознавания
-    text = re.sub(r"\bчасо[в]*\b", "ч", text)
-    text = re.sub(r"\bкилометр[а-я]*\b", "км", text)
 
-    # восстанавливаем бренды с большой буквы
-    text = re.sub(r"\bбелаз\b", "БелАЗ", text, flags=re.IGNORECASE)
-    text = re.sub(r"\bкамаз\b", "КамАЗ", text, flags=re.IGNORECASE)
-    text = re.sub(r"\bvolvo\b", "Volvo", text, flags=re.IGNORECASE)
-    text = re.sub(r"\bkomatsu\b", "Komatsu", text, flags=re.IGNORECASE)
-    text = re.sub(r"\bcat\b", "CAT", text, flags=re.IGNORECASE)
+async def tg_perf(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    await update.message.reply_text(f"<pre>{format_perf_report()}</pre>", parse_mode="HTML")
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка апдейтов: разные чаты — одновременно, один чат — строго по очереди.
+
+    Сначала апдейт ждёт свой чат (asyncio.Lock честный, так что порядок
+    сообщений водителя сохраняется), и только потом — общий слот из
+    max_concurrent_updates. Поэтому чат с длинной очередью занимает не
+    больше одного слота и не тормозит остальных.
+    """
+
+    def __init__(self, max_concurrent_updates=MAX_CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates)
+        self._slots = None
+        self._chats = {}  # chat_id -> [Lock, сколько апдейтов его ждут или держат]
+        self.waiting = 0
+        self.running = 0
+        self.processed = 0
+
+    async def initialize(self):
+        self._slots = asyncio.Semaphore(self.max_concurrent_updates)
+
+    async def shutdown(self):
+        pass
+
+    async def process_update(self, update, coroutine):
+        chat = getattr(update, "effective_chat", None)
+        entry = self._chats.setdefault(chat.id, [asyncio.Lock(), 0]) if chat else None
+        if entry:
+            entry[1] += 1
+        self.waiting += 1
+        queued = time.perf_counter()
+        try:
+            async with entry[0] if entry else contextlib.nullcontext():
+                async with self._slots:
+                    self.waiting -= 1
+                    self.running += 1
+                    perf_stats.add("tg.queue", time.perf_counter() - queued)
+                    try:
+                        await self.do_process_update(update, coroutine)
+                    finally:
+                        self.running -= 1
+                        self.processed += 1
+        finally:
+            if entry:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._chats[chat.id]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "chats": len(self._chats),
+            "longest_chat_queue": max((n for _, n in self._chats.values()), default=0),
+            "processed": self.processed,
+        }
+
+
+update_processor = PerChatUpdateProcessor()
+
+
+def build_application():
+    app = ApplicationBuilder().token(BOT_TOKEN).concurrent_updates(update_processor).build()
+    app.add_handler(CommandHandler("start", tg_start))
+    app.add_handler(CommandHandler("perf", tg_perf))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, tg_handle))
+    app.add_handler(MessageHandler(filters.VOICE, tg_handle_voice))
+    return app
 
-    return text.strip()
 
+def webhook_secret():
+    """Секрет для заголовка X-Telegram-Bot-Api-Secret-Token.
 
+    Должен совпадать у всех копий бота за одним адресом: Telegram помнит только
+    последний зарегистрированный, и копия с другим секретом отвечала бы 403.
+    Поэтому без явного secret_token он не случайный, а выводится из токена бота.
+    """
+    return WEBHOOK.get("secret_token") or hashlib.sha256(f"webhook:{BOT_TOKEN}".encode()).hexdigest()
 
-def run_telegram_bot():
-    import asyncio
+async def start_webhook(app):
+    """Поднимает HTTP-сервер и регистрирует webhook в Telegram. False — не получилось."""
+    if not WEBHOOK.get("url"):
+        logger.warning("WEBHOOK.enabled, но url не задан.")
+        return False
+    path = WEBHOOK.get("path", "telegram").strip("/")
+    try:
+        await app.updater.start_webhook(
+            listen=WEBHOOK.get("listen", "127.0.0.1"),
+            port=WEBHOOK.get("port", 8443),
+            url_path=path,
+            webhook_url=f"{WEBHOOK['url'].rstrip('/')}/{path}",
+            secret_token=webhook_secret(),
+        )
+    except Exception as e:
+        logger.error("Не удалось включить webhook: %s", e)
+        return False
+    logger.info("Бот запущен (webhook %s).", WEBHOOK["url"])
+    return True
+
+
+# ===========================
+# МЕТРИКИ PROMETHEUS
+# ===========================
+metrics.gauge("chassbot_voice_pending", lambda: voice_queue.pending)
+metrics.gauge("chassbot_updates_running", lambda: update_processor.running)
+metrics.gauge("chassbot_updates_waiting", lambda: update_processor.waiting)
+metrics.gauge("chassbot_journal_pending",
+              lambda: sheet_writer.journal.count("pending") + sheet_writer.journal.count("sending"))
+metrics.gauge("chassbot_sheets_rate_tokens", lambda: sheets_limiter.stats()["tokens"])
+metrics.gauge("chassbot_sheets_rate_wait_seconds", lambda: sheets_limiter.stats()["wait_seconds"])
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # каждые 15 секунд скрейп — в лог не пишем
+
+
+def start_metrics_server(port_offset=0):
+    if not METRICS.get("enabled"):
+        return None
+    address = (METRICS.get("listen", "127.0.0.1"), METRICS.get("port", 9108) + port_offset)
+    try:
+        server = http.server.ThreadingHTTPServer(address, MetricsHandler)
+    except OSError as e:
+        logger.error("Не удалось открыть /metrics на %s:%s: %s", *address, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="MetricsThread", daemon=True).start()
+    logger.info("Метрики: http://%s:%s/metrics", *address)
+    return server
+
+
+# ===========================
+# НЕСКОЛЬКО ПРОЦЕССОВ
+# ===========================
+async def tg_forward(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    shards.forward(update)
+
+
+def build_ingress_application():
+    """Приёмник апдейтов: сам ничего не разбирает, только раздаёт воркерам."""
+    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    app.add_handler(TypeHandler(Update, tg_forward))
+    return app
+
+
+class ShardSupervisor:
+    """Раздаёт апдейты по процессам-воркерам и перезапускает упавших.
+
+    Апдейт уходит воркеру chat_id % count через его multiprocessing-очередь,
+    так что один чат всегда попадает в один процесс и порядок сообщений
+    сохраняется. У каждого воркера свой журнал (journal_w<N>.db), свой
+    SheetWriter и своя доля квоты Sheets (ещё одна доля — у главного процесса,
+    который пишет строки из окна).
+
+    Каждый апдейт идёт с порядковым номером. Воркер публикует номер, до
+    которого все апдейты обработаны до конца (строка уже в журнале), а здесь
+    хранятся все остальные — и ждущие в очереди, и взятые в работу. Упавший
+    воркер перезапускается с новой очередью (старую он мог оставить
+    с захваченной блокировкой), и все необработанные апдейты отправляются
+    в неё заново. Апдейт, который воркер успел записать, но не успел
+    отметить, может прийти повторно — дубль строки не даст ключ в журнале.
+    Если воркер раз за разом падает, не сдвинувшись с одного апдейта, после
+    max_redeliveries попыток этот апдейт выбрасывается, чтобы не падать вечно.
+    """
+
+    max_redeliveries = 3
+
+    def __init__(self, count=WORKERS):
+        self.count = count
+        self.queues = []
+        self.processes = []
+        self.restarts = 0
+        self._acked = []     # multiprocessing.RawValue: номер, до которого воркер всё обработал
+        self._unsent = []    # (номер, апдейт), которые воркер ещё не обработал
+        self._seq = []       # следующий номер для каждого воркера
+        self._stuck = []     # (номер первого необработанного, сколько падений подряд на нём)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._ctx = multiprocessing.get_context("spawn")
+
+    @property
+    def enabled(self):
+        return self.count > 1
+
+    def start(self):
+        self.queues = [None] * self.count
+        self.processes = [None] * self.count
+        self._acked = [None] * self.count
+        self._unsent = [collections.deque() for _ in range(self.count)]
+        self._seq = [1] * self.count
+        self._stuck = [(0, 0)] * self.count
+        for i in range(self.count):
+            self._spawn(i)
+        threading.Thread(target=self._watch, name="ShardSupervisorThread", daemon=True).start()
+
+    def _spawn(self, index):
+        """Запускает воркер с новой очередью; возвращает, сколько апдейтов в неё переотправлено."""
+        with self._lock:
+            if self._acked[index] is not None:
+                self._trim(index)
+                self._drop_poison(index)
+            self.queues[index] = self._ctx.Queue()
+            # без блокировки: пишет только воркер, и упав, он не оставит её захваченной
+            self._acked[index] = self._ctx.RawValue("q", 0)
+            for item in self._unsent[index]:
+                self.queues[index].put(item)
+            # не daemon: воркеру нужен свой пул процессов для голосовых
+            proc = self._ctx.Process(target=run_shard_worker,
+                                     args=(index, self.count, self.queues[index], self._acked[index]),
+                                     name=f"ChassBotWorker-{index}")
+            proc.start()
+            self.processes[index] = proc
+            return len(self._unsent[index])
+
+    def _watch(self):
+        while not self._stopping.wait(1.0):
+            for i, proc in enumerate(self.processes):
+                if not proc.is_alive() and not self._stopping.is_set():
+                    code = proc.exitcode
+                    resent = self._spawn(i)
+                    self.restarts += 1
+                    logger.error("Воркер %d завершился (код %s) — перезапущен, переотправлено апдейтов: %d.",
+                                 i, code, resent)
+
+    def _trim(self, index):
+        """Выбрасывает из _unsent то, что воркер обработал до конца. Вызывать под self._lock."""
+        unsent = self._unsent[index]
+        acked = self._acked[index].value
+        while unsent and unsent[0][0] < acked:
+            unsent.popleft()
+
+    def _drop_poison(self, index):
+        unsent = self._unsent[index]
+        if not unsent:
+            return
+        seq, crashes = self._stuck[index]
+        crashes = crashes + 1 if unsent[0][0] == seq else 1
+        if crashes > self.max_redeliveries:
+            logger.error("Воркер %d падает на апдейте %s и после %d переотправок — пропускаю его.",
+                         index, unsent[0][1].get("update_id"), self.max_redeliveries)
+            unsent.popleft()
+            crashes = 0
+        self._stuck[index] = (unsent[0][0] if unsent else 0, crashes)
+
+    def forward(self, update):
+        chat = update.effective_chat
+        index = chat.id % self.count if chat else 0
+        with self._lock:
+            self._trim(index)
+            item = (self._seq[index], update.to_dict())
+            self._seq[index] += 1
+            self._unsent[index].append(item)
+            self.queues[index].put(item)
+
+    def stop(self, timeout=10):
+        if not self.processes:
+            return
+        self._stopping.set()
+        for q in self.queues:
+            q.put(None)
+        for proc in self.processes:
+            proc.join(timeout)
+            if proc.is_alive():
+                proc.terminate()
+                proc.join()
+
+
+shards = ShardSupervisor()
+
+
+class ShardUpdateProcessor(PerChatUpdateProcessor):
+    """PerChatUpdateProcessor воркера: сообщает приёмнику, какие апдейты обработаны до конца.
+
+    В acked публикуется наименьший номер апдейта, который ещё в работе
+    (или следующий ожидаемый, если в работе ничего нет): всё, что меньше,
+    уже прошло обработчики, и строки лежат в журнале.
+    """
+
+    def __init__(self, acked, max_concurrent_updates=MAX_CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates)
+        self.acked = acked
+        self._in_work = {}  # id(update) -> номер
+        self._next = 0
+
+    def received(self, seq, update):
+        """Апдейт взят из очереди приёмника — до конца обработки он считается необработанным."""
+        self._in_work[id(update)] = seq
+        self._next = seq + 1
+        self._publish()
+
+    async def do_process_update(self, update, coroutine):
+        try:
+            await coroutine
+        finally:
+            self._in_work.pop(id(update), None)
+            self._publish()
+
+    def _publish(self):
+        self.acked.value = min(self._in_work.values(), default=self._next)
+
+
+def share_sheets_quota(parts):
+    """Делит квоту Sheets поровну между процессами, которые пишут в одну таблицу."""
+    limits = sheets_limiter.stats()
+    sheets_limiter.configure(limits["per_minute"] / parts, max(1, limits["burst"] // parts))
+
+
+def run_shard_worker(index, count, updates, acked):
+    """Точка входа процесса-воркера."""
+    global update_processor
+    # окна Tk в воркере нет, и очередь лога никто не разбирает — пишем только в консоль
+    logger.removeHandler(queue_handler)
+    base, ext = os.path.splitext(sheet_writer.journal.path)
+    sheet_writer.journal.path = f"{base}_w{index}{ext}"
+    share_sheets_quota(count + 1)
+    sheet_writer.start()
+    start_metrics_server(1 + index)
+    update_processor = ShardUpdateProcessor(acked, update_processor.max_concurrent_updates)
+    logger.info("Воркер %d из %d запущен.", index, count)
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
-    app.add_handler(CommandHandler("start", tg_start))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, tg_handle))
-    app.add_handler(MessageHandler(filters.VOICE, tg_handle_voice))
-    logger.info("Бот запущен...")
-    loop.run_until_complete(app.run_polling())
+    loop.run_until_complete(serve_shard(build_application(), updates))
+
+
+async def serve_shard(app, updates):
+    """Апдейты из очереди приёмника — в update_queue приложения, дальше как обычно."""
+    await app.initialize()
+    await app.start()
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            item = await loop.run_in_executor(None, updates.get)
+            if item is None:
+                break
+            seq, data = item
+            update = Update.de_json(data, app.bot)
+            update_processor.received(seq, update)
+            await app.update_queue.put(update)
+    finally:
+        await app.stop()
+        await app.shutdown()
+
+
+bot_loop = None  # цикл потока бота
+bot_stop = None  # asyncio.Event в этом цикле — stop_telegram_bot() просит бота завершиться
+
+
+async def serve_telegram(app):
+    global bot_stop
+    bot_stop = asyncio.Event()
+    await app.initialize()
+    webhook = False
+    try:
+        webhook = WEBHOOK.get("enabled") and await start_webhook(app)
+        shared = WEBHOOK.get("enabled") and not WEBHOOK.get("delete_on_stop", True)
+        while shared and not webhook:
+            # start_polling снял бы webhook, через который работают другие копии бота
+            logger.error("Polling не включаем: webhook общий для нескольких копий. Повтор через %s с.",
+                         WEBHOOK.get("retry_sec", 30))
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(bot_stop.wait(), WEBHOOK.get("retry_sec", 30))
+            if bot_stop.is_set():
+                return
+            webhook = await start_webhook(app)
+        if not webhook:
+            # start_polling сам снимает webhook, оставшийся от прошлого запуска
+            await app.updater.start_polling()
+            logger.info("Бот запущен (polling)...")
+        await app.start()
+        await bot_stop.wait()
+    finally:
+        if app.updater.running:
+            await app.updater.stop()
+        if webhook and WEBHOOK.get("delete_on_stop", True):
+            await app.bot.delete_webhook()
+        if app.running:
+            await app.stop()
+        await app.shutdown()
+
+
+def run_telegram_bot():
+    global bot_loop
+    bot_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(bot_loop)
+    app = build_ingress_application() if shards.enabled else build_application()
+    bot_loop.run_until_complete(serve_telegram(app))
+
+
+def stop_telegram_bot(thread, timeout=10):
+    """Останавливает бота из другого потока: снять webhook, закрыть соединения."""
+    if bot_stop is not None and thread.is_alive():
+        bot_loop.call_soon_threadsafe(bot_stop.set)
+        thread.join(timeout)
 
 # ===========================
 # TK GUI
@@ -397,11 +2037,20 @@ class AppUI:
         parsed = parse_message(text)
         self._fill_preview(parsed)
         row = make_row(parsed)
-        ok = append_row_with_retry(row)
-        if ok:
-            self._append_log("✅ Запись добавлена в Google Sheets.\n")
+        try:
+            fut = sheet_writer.submit(row)
+        except Exception as e:
+            self._append_log(f"⚠ Не удалось сохранить в журнал: {e}\n")
+            return
+        self._append_log("📥 Сообщение сохранено, отправляется в таблицу...\n")
+        fut.add_done_callback(self._on_send_done)
+
+    def _on_send_done(self, fut):
+        # вызывается из потока SheetWriter, поэтому пишем через log_queue
+        if fut.result():
+            log_queue.put("✅ Запись добавлена в Google Sheets.")
         else:
-            self._append_log("⚠ Не удалось записать.\n")
+            log_queue.put("⚠ Не удалось записать.")
 
     def open_settings_window(self):
         win = tk.Toplevel(self.root)
@@ -424,7 +2073,7 @@ class AppUI:
         ent_sheet.pack(fill="x")
 
         def save_and_apply():
-            global BOT_TOKEN, SERVICE_ACCOUNT_FILE, SPREADSHEET_ID, sheet
+            global BOT_TOKEN, SERVICE_ACCOUNT_FILE, SPREADSHEET_ID
             BOT_TOKEN = ent_token.get().strip()
             SERVICE_ACCOUNT_FILE = ent_cred.get().strip()
             link = ent_sheet.get().strip()
@@ -435,16 +2084,16 @@ class AppUI:
                     SPREADSHEET_ID = link
             else:
                 SPREADSHEET_ID = link
-            save_config({
+            # остальные ключи config.json (лимиты, словарь, webhook и т.д.) окно не знает — не трогаем их
+            config = load_config()
+            config.update({
                 "BOT_TOKEN": BOT_TOKEN,
                 "GOOGLE_APPLICATION_CREDENTIALS": SERVICE_ACCOUNT_FILE,
                 "SPREADSHEET_ID": SPREADSHEET_ID
             })
-            try:
-                sheet = connect_sheets()
-                self._append_log("✅ Настройки сохранены и подключение обновлено.\n")
-            except Exception as e:
-                self._append_log(f"⚠ Ошибка подключения: {e}\n")
+            save_config(config)
+            sheet_writer.reconnect()
+            self._append_log("✅ Настройки сохранены, переподключаемся к таблице.\n")
             win.destroy()
 
         tk.Button(win, text="Сохранить", command=save_and_apply).pack(pady=10)
@@ -456,23 +2105,47 @@ cfg = load_config()
 BOT_TOKEN = cfg.get("BOT_TOKEN", BOT_TOKEN)
 SERVICE_ACCOUNT_FILE = cfg.get("GOOGLE_APPLICATION_CREDENTIALS", SERVICE_ACCOUNT_FILE)
 SPREADSHEET_ID = cfg.get("SPREADSHEET_ID", SPREADSHEET_ID)
-
-sheet = connect_sheets()
-try:
-    first_row = sheet.row_values(1)
-    if not first_row or first_row[:len(HEADERS)] != HEADERS:
-        sheet.insert_row(HEADERS, index=1)
-except Exception as e:
-    logger.warning("Не удалось проверить заголовки: %s", e)
+sheet_writer.batch_size = cfg.get("SHEETS_BATCH_SIZE", sheet_writer.batch_size)
+sheet_writer.flush_interval = cfg.get("SHEETS_FLUSH_INTERVAL", sheet_writer.flush_interval)
+sheet_writer.journal.path = cfg.get("JOURNAL_FILE", sheet_writer.journal.path)
+duplicate_index.window_min = cfg.get("DEDUP_WINDOW_MIN", duplicate_index.window_min)
+ASR_BACKENDS = cfg.get("ASR_BACKENDS", ASR_BACKENDS)
+text_normalizer.extend(cfg.get("VOCABULARY", {}), cfg.get("UNITS", {}))
+transcript_cache.path = cfg.get("VOICE_CACHE_FILE", transcript_cache.path)
+transcript_cache.max_entries = cfg.get("VOICE_CACHE_MAX_ENTRIES", transcript_cache.max_entries)
+transcript_cache.max_age_days = cfg.get("VOICE_CACHE_MAX_AGE_DAYS", transcript_cache.max_age_days)
+VOSK_MODEL_PATH = cfg.get("VOSK_MODEL_PATH", VOSK_MODEL_PATH)
+VOICE_CHUNK_MAX_SEC = cfg.get("VOICE_CHUNK_MAX_SEC", VOICE_CHUNK_MAX_SEC)
+VOICE_AUDIO_FILTER = cfg.get("VOICE_AUDIO_FILTER", VOICE_AUDIO_FILTER)
+voice_queue.workers = cfg.get("VOICE_WORKERS", voice_queue.workers)
+voice_queue.max_pending = cfg.get("VOICE_QUEUE_MAX", voice_queue.max_pending)
+ADMIN_IDS = cfg.get("ADMIN_IDS", ADMIN_IDS)
+WEBHOOK = {**WEBHOOK, **cfg.get("WEBHOOK", {})}
+METRICS = {**METRICS, **cfg.get("METRICS", {})}
+SAVE_CONFIRM_TIMEOUT = cfg.get("SAVE_CONFIRM_TIMEOUT", SAVE_CONFIRM_TIMEOUT)
+update_processor = PerChatUpdateProcessor(cfg.get("MAX_CONCURRENT_UPDATES", MAX_CONCURRENT_UPDATES))
+shards.count = cfg.get("WORKERS", shards.count)
+rate_cfg = cfg.get("SHEETS_RATE_LIMIT", {})
+sheets_limiter.configure(rate_cfg.get("per_minute", sheets_limiter.per_minute),
+                         rate_cfg.get("burst", sheets_limiter.burst))
 
 def start_threads():
+    if shards.enabled:
+        share_sheets_quota(shards.count + 1)  # доля главного процесса — строки из окна
+    sheet_writer.start()  # подключиться к таблице и дослать то, что осталось в журнале
+    start_metrics_server()
+    if shards.enabled:
+        shards.start()
     t = threading.Thread(target=run_telegram_bot, name="TelegramBotThread", daemon=True)
     t.start()
+    return t
 
 def main():
-    start_threads()
+    bot_thread = start_threads()
     app = AppUI()
     app.run()
+    stop_telegram_bot(bot_thread)
+    shards.stop()
 
 atexit.register(lambda: logger.info("Завершение работы..."))
 
@@ -0,0 +1,161 @@
+# bench_parser.py
+# Бенчмарк и проверка точности парсера: parse_message, normalize_recognized_text, make_row.
+# Работает офлайн — к Telegram и Google не обращается, только импортирует основной скрипт.
+#
+#   python bench_parser.py                 # по умолчанию 500 прогонов корпуса
+#   python bench_parser.py --repeat 2000
+#   python bench_parser.py --script MyChassBot_SheetsExample_5_and-tk_and-wan_orOogg.py
+
+import os
+import sys
+import time
+import argparse
+import importlib.util
+
+DEFAULT_SCRIPT = "MyChassBot_SheetsExample_5_and-tk_and-wan_orOogg.py"
+
+# -------------------------
+# Корпус: реальные по форме сообщения с полевых объектов и ожидаемые поля.
+# Описание (description) — свободный текст, поэтому его точность не считаем.
+# -------------------------
+CORPUS = [
+    ("Маломырский рудник , Амурская область шасси 773 23310км, 2245ч на спуске защита: перегрев ДВС",
+     {"organization": "Маломырский рудник , Амурская область", "chassis": "773", "model": "",
+      "failure": "защита: перегрев двс", "mileage_hours": "23310 км, 2245 ч"}),
+    ("Покровский рудник шасси 1021 БелАЗ 75131, 48200 км, 6120 ч. Ошибка 2418, не заводится",
+     {"organization": "Покровский рудник", "chassis": "1021", "model": "БелАЗ",
+      "failure": "ошибка 2418", "mileage_hours": "48200 км, 6120 ч"}),
+    ("Олимпиада — шасси: 455 Komatsu HD785 отказ тормозов на подъёме",
+     {"organization": "Олимпиада", "chassis": "455", "model": "Komatsu",
+      "failure": "отказ тормозов на подъёме", "mileage_hours": ""}),
+    ("Кузбасс, разрез Талдинский шасси 88 CAT 777 12000км защита по давлению масла",
+     {"organization": "Кузбасс, разрез Талдинский", "chassis": "88", "model": "CAT",
+      "failure": "защита по давлению масла", "mileage_hours": "12000 км"}),
+    ("ГОК Эльгинский на шасси 301 Volvo A40 ошибка: датчик уровня топлива, 3400ч",
+     {"organization": "ГОК Эльгинский", "chassis": "301", "model": "Volvo",
+      "failure": "ошибка: датчик уровня топлива", "mileage_hours": "3400 ч"}),
+    ("Нерюнгри: КамАЗ 6520 шасси 5520 156000 км отказ ГУР",
+     {"organization": "Нерюнгри", "chassis": "5520", "model": "КамАЗ",
+      "failure": "отказ гур", "mileage_hours": "156000 км"}),
+    ("Артель Амур шасси 12 Shacman 90000 км, 2000 ч ошибка ABS; защита КПП",
+     {"organization": "Артель Амур", "chassis": "12", "model": "Shacman",
+      "failure": "защита кпп; ошибка abs", "mileage_hours": "90000 км, 2000 ч"}),
+    ("Рудник Пионер шасси 640 Terex TR100 ошибка 15 ошибка 22, стоит в боксе",
+     {"organization": "Рудник Пионер", "chassis": "640", "model": "Terex",
+      "failure": "ошибка 15; ошибка 22", "mileage_hours": ""}),
+    ("Карьер Западный - белаз шасси 4410 31500км 4100ч течь гидравлики",
+     {"organization": "Карьер Западный", "chassis": "4410", "model": "белаз",
+      "failure": "", "mileage_hours": "31500 км, 4100 ч"}),
+    ("шасси 998 dumper 1500ч отказ стартера",
+     {"organization": "", "chassis": "998", "model": "dumper",
+      "failure": "отказ стартера", "mileage_hours": "1500 ч"}),
+    ("Разрез Черногорский, шасси 707 Moxy MT31 21000 км защита: перегрев гидравлики. ошибка 7",
+     {"organization": "Разрез Черногорский", "chassis": "707", "model": "Moxy",
+      "failure": "защита: перегрев гидравлики; ошибка 7", "mileage_hours": "21000 км"}),
+    ("Купол где шасси 55 CAT 785 7800 ч вибрация на ходу",
+     {"organization": "Купол", "chassis": "55", "model": "CAT",
+      "failure": "", "mileage_hours": "7800 ч"}),
+]
+
+# Сырой текст из распознавания речи и то, что должно получиться после нормализации
+VOICE_CORPUS = [
+    ("Белаз шасси 12 3400 часов",
+     "БелАЗ шасси 12 3400 ч"),
+    ("Шасси 88 CAT 12000 километров защита по давлению масла",
+     "шасси 88 CAT 12000 км защита по давлению масла"),
+    ("komatsu шасси 455 отказ тормозов",
+     "Komatsu шасси 455 отказ тормозов"),
+    ("шасси 773 двадцать три тысячи триста десять километров две тысячи двести сорок пять часов белаз",
+     "шасси 773 23310 км 2245 ч БелАЗ"),
+    ("камаз шасси 5520 сто пятьдесят шесть тысяч километров отказ гур",
+     "КамАЗ шасси 5520 156000 км отказ гур"),
+    # время и длительность — не моточасы: в "ч" превращается только "часов" и "моточас..."
+    ("шасси 12 стоит два часа, 3400 часов",
+     "шасси 12 стоит 2 часа, 3400 ч"),
+    ("заглох в три часа ночи, пробег 4500 моточасов",
+     "заглох в 3 часа ночи, пробег 4500 ч"),
+]
+
+FIELDS = ["organization", "chassis", "model", "failure", "mileage_hours"]
+
+
+def load_bot_module(path):
+    """Импортирует основной скрипт как модуль (имя файла с дефисами обычным import не взять)."""
+    spec = importlib.util.spec_from_file_location("chassbot", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["chassbot"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def bench(name, func, inputs, repeat):
+    """Гоняет func по всем inputs repeat раз; печатает сообщений/сек и p50/p99 одного вызова."""
+    timings = []
+    perf = time.perf_counter
+    started = perf()
+    for _ in range(repeat):
+        for item in inputs:
+            t0 = perf()
+            func(item)
+            timings.append(perf() - t0)
+    total = perf() - started
+    timings.sort()
+    print(f"{name:<28} {len(timings) / total:>12,.0f} msg/s   "
+          f"p50 {percentile(timings, 50) * 1e6:8.1f} мкс   p99 {percentile(timings, 99) * 1e6:8.1f} мкс")
+
+
+def check_accuracy(bot):
+    print("\nТочность parse_message по полям:")
+    misses = []
+    for field in FIELDS:
+        ok = 0
+        for text, expected in CORPUS:
+            got = bot.parse_message(text)[field]
+            if got == expected[field]:
+                ok += 1
+            else:
+                misses.append((field, text, expected[field], got))
+        print(f"  {field:<15} {ok:>3}/{len(CORPUS)}  ({ok / len(CORPUS):.0%})")
+
+    ok = 0
+    for raw, expected in VOICE_CORPUS:
+        got = bot.normalize_recognized_text(raw)
+        if got == expected:
+            ok += 1
+        else:
+            misses.append(("normalize", raw, expected, got))
+    print(f"\nТочность normalize_recognized_text: {ok}/{len(VOICE_CORPUS)}  ({ok / len(VOICE_CORPUS):.0%})")
+
+    if misses:
+        print("\nРасхождения:")
+        for field, text, expected, got in misses:
+            print(f"  [{field}] {text}\n      ожидали: {expected!r}\n      получили: {got!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк и точность парсера сообщений")
+    parser.add_argument("--script", default=DEFAULT_SCRIPT, help="какой скрипт бота проверять")
+    parser.add_argument("--repeat", type=int, default=500, help="сколько раз прогнать корпус")
+    args = parser.parse_args()
+
+    bot = load_bot_module(os.path.abspath(args.script))
+    texts = [text for text, _ in CORPUS]
+    voice = [raw for raw, _ in VOICE_CORPUS]
+    parsed = [bot.parse_message(text) for text in texts]
+
+    print(f"Скрипт: {args.script}, корпус: {len(texts)} сообщений × {args.repeat}\n")
+    bench("parse_message", bot.parse_message, texts, args.repeat)
+    bench("normalize_recognized_text", bot.normalize_recognized_text, voice, args.repeat)
+    bench("make_row", bot.make_row, parsed, args.repeat)
+    check_accuracy(bot)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+# import_chat_export.py
+# Загрузка старых сообщений из экспорта чата Telegram Desktop (result.json) в Google Sheets.
+#
+# Каждое текстовое сообщение проходит через parse_message/make_row, дата берётся
+# из самого сообщения, а не текущая. Строки сначала складываются в отдельный
+# журнал (import_journal.db) с ключом tg:<chat_id>:<message_id> — тем же, что
+# ставит бот, — и уходят в таблицу большими пачками через SheetWriter.
+# Если импорт упал, достаточно запустить его ещё раз: уже записанные сообщения
+# (и те, что бот успел записать сам) повторно не попадут в таблицу.
+#
+#   python import_chat_export.py result.json
+#   python import_chat_export.py result.json --batch-size 500 --dry-run
+
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import importlib.util
+from datetime import datetime, timezone
+
+DEFAULT_SCRIPT = "MyChassBot_SheetsExample_5_and-tk_and-wan_orOogg.py"
+DEFAULT_JOURNAL = "import_journal.db"
+READ_CHUNK = 1 << 16
+
+
+def load_bot_module(path):
+    """Импортирует основной скрипт как модуль (имя файла с дефисами обычным import не взять).
+
+    Модуль регистрируется под именем файла, а его папка добавляется в sys.path:
+    процессы пула parse_messages при spawn (Windows) импортируют его по этому имени.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    folder = os.path.dirname(path)
+    if folder not in sys.path:
+        sys.path.insert(0, folder)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+# -------------------------
+# Потоковое чтение экспорта
+# -------------------------
+def iter_export(path):
+    """Читает экспорт по кусочкам: сначала отдаёт шапку чата (dict), потом сообщения по одному.
+
+    Файл экспорта может весить сотни мегабайт, поэтому целиком через json.load
+    его не читаем: находим массив "messages" и декодируем элементы по одному.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf = ""
+        while '"messages"' not in buf:
+            chunk = f.read(READ_CHUNK)
+            if not chunk:
+                raise ValueError("В файле нет массива messages — это точно экспорт одного чата?")
+            buf += chunk
+        head, buf = buf.split('"messages"', 1)
+        # в шапке только простые поля (name, type, id) — достаточно закрыть объект
+        yield json.loads(head.rstrip().rstrip(",") + "}")
+
+        while "[" not in buf:
+            buf += f.read(READ_CHUNK)
+        buf = buf[buf.index("[") + 1:]
+
+        pos = 0
+        while True:
+            # пропускаем пробелы и запятые между элементами
+            while True:
+                while pos < len(buf) and buf[pos] in " \t\r\n,":
+                    pos += 1
+                if pos < len(buf):
+                    break
+                chunk = f.read(READ_CHUNK)
+                if not chunk:
+                    return
+                buf, pos = buf[pos:] + chunk, 0
+            if buf[pos] == "]":
+                return
+            while True:
+                try:
+                    obj, end = decoder.raw_decode(buf, pos)
+                    break
+                except json.JSONDecodeError:
+                    chunk = f.read(READ_CHUNK)
+                    if not chunk:
+                        raise
+                    buf, pos = buf[pos:] + chunk, 0
+            yield obj
+            pos = end
+
+
+def bot_api_chat_id(chat):
+    """id из экспорта → chat_id, который видит Bot API (для супергрупп -100…, для групп минус)."""
+    chat_id = chat.get("id")
+    chat_type = chat.get("type", "")
+    if chat_type.endswith("supergroup") or chat_type.endswith("channel"):
+        return int(f"-100{chat_id}")
+    if chat_type == "private_group":
+        return -int(chat_id)
+    return chat_id
+
+
+def message_text(msg):
+    """Поле text в экспорте — строка или список из строк и кусочков с разметкой."""
+    text = msg.get("text", "")
+    if isinstance(text, list):
+        text = "".join(part if isinstance(part, str) else part.get("text", "") for part in text)
+    return text.strip()
+
+
+def message_date(msg):
+    if "date_unixtime" in msg:
+        dt = datetime.fromtimestamp(int(msg["date_unixtime"]), timezone.utc)
+    else:
+        dt = datetime.fromisoformat(msg["date"])
+    return dt.astimezone().strftime("%Y-%m-%d %H:%M:%S %Z")
+
+
+def iter_reports(path):
+    """(ключ, дата, текст) для каждого текстового сообщения экспорта."""
+    messages = iter_export(path)
+    chat_id = bot_api_chat_id(next(messages))
+    for msg in messages:
+        if msg.get("type") != "message":
+            continue
+        text = message_text(msg)
+        if text:
+            yield f"tg:{chat_id}:{msg['id']}", message_date(msg), text
+
+
+# -------------------------
+# Импорт
+# -------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Импорт экспорта чата Telegram в Google Sheets")
+    parser.add_argument("export", help="путь к result.json из Telegram Desktop")
+    parser.add_argument("--script", default=DEFAULT_SCRIPT, help="скрипт бота, из которого брать парсер")
+    parser.add_argument("--journal", default=DEFAULT_JOURNAL, help="файл журнала импорта")
+    parser.add_argument("--batch-size", type=int, default=500, help="строк в одном append_rows")
+    parser.add_argument("--processes", type=int, default=None, help="процессов для парсинга (по умолчанию все ядра)")
+    parser.add_argument("--dry-run", action="store_true", help="только разобрать и посчитать, ничего не писать")
+    args = parser.parse_args()
+
+    bot = load_bot_module(os.path.abspath(args.script))
+
+    known_keys = set()
+    if not args.dry_run:
+        bot.sheet = bot.connect_sheets()
+        bot.ensure_headers(bot.sheet)
+        known_keys = set(bot.sheets_call(bot.sheet.col_values, len(bot.HEADERS)))
+        print(f"В таблице уже есть строк с ключами: {len(known_keys)}")
+
+    journal = bot.RowJournal(args.journal)
+    reports, for_parser = itertools.tee(iter_reports(args.export))
+    texts = (text for _, _, text in for_parser)
+
+    total = queued = 0
+    for (key, date_str, _), parsed in zip(reports, bot.parse_messages(texts, processes=args.processes)):
+        total += 1
+        if key in known_keys:
+            continue
+        parsed["date"] = date_str
+        if args.dry_run or journal.add(bot.make_row(parsed), key) in ("pending", "sending"):
+            queued += 1
+        if total % 1000 == 0:
+            print(f"Разобрано сообщений: {total}")
+    print(f"Всего текстовых сообщений: {total}, к отправке: {queued}")
+    if args.dry_run:
+        return
+
+    writer = bot.SheetWriter(journal, batch_size=args.batch_size, flush_interval=0)
+    writer.start()
+    while True:
+        left = journal.count("pending") + journal.count("sending")
+        if not left:
+            break
+        if writer.stuck is not None:
+            # таблица недоступна целиком — ждать бессмысленно; строки остаются в журнале
+            print(f"Запись остановлена: {writer.stuck}. Осталось отправить: {left}. "
+                  f"Исправьте доступ к таблице и запустите импорт ещё раз.")
+            sys.exit(1)
+        print(f"Осталось отправить: {left}")
+        time.sleep(5)
+    print(f"Готово. Записано: {journal.count('sent')}, отклонено Google: {journal.count('failed')}")
+
+
+if __name__ == "__main__":
+    main()
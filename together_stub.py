@@ -0,0 +1,88 @@
+# together_stub.py
+# Локальная заглушка Together AI (/v1/chat/completions) — чтобы гонять ботов без ключа и без расхода денег.
+# Отвечает в том же формате, что и настоящий API, с настраиваемой задержкой и долей ошибок.
+#
+#   python together_stub.py                         # http://127.0.0.1:8089/v1/chat/completions
+#   python together_stub.py --delay 1.5 --fail-rate 0.1
+#
+# В боте: TOGETHER_API_URL=http://127.0.0.1:8089/v1/chat/completions
+
+import json
+import time
+import random
+import argparse
+import threading
+import http.server
+
+PATH = "/v1/chat/completions"
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, как у настоящего API
+    delay = 0.0
+    fail_rate = 0.0
+    served = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path != PATH:
+            self._send(404, {"error": {"message": "not found"}})
+            return
+        try:
+            request = json.loads(body)
+            prompt = request["messages"][-1]["content"]
+        except Exception:
+            self._send(400, {"error": {"message": "bad request"}})
+            return
+        with StubHandler.lock:
+            StubHandler.served += 1
+            number = StubHandler.served
+        time.sleep(self.delay)
+        if random.random() < self.fail_rate:
+            self._send(random.choice([429, 500, 503]), {"error": {"message": "stub failure"}})
+            return
+        self._send(200, {
+            "id": f"stub-{number}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", ""),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": f"(заглушка #{number}) {prompt[:200]}"},
+                "finish_reason": "stop",
+            }],
+        })
+
+    def _send(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} {format % args}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная заглушка Together AI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--delay", type=float, default=0.3, help="задержка ответа, сек")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="доля ответов с ошибкой 429/5xx")
+    args = parser.parse_args()
+
+    StubHandler.delay = args.delay
+    StubHandler.fail_rate = args.fail_rate
+    server = http.server.ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"Заглушка Together: http://{args.host}:{args.port}{PATH}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()